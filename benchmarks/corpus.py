@@ -0,0 +1,121 @@
+"""
+A synthetic corpus of Mastodon status payloads for benchmarks and load tests.
+The content uses the same markup Mastodon generates: mention h-cards, hashtag links, shortened links with invisible spans,
+paragraphs, line breaks, and escaped characters.
+The corpus is generated from a seed, so the same seed always gives the same statuses.
+"""
+
+from __future__ import annotations
+import datetime
+import random
+
+BOT_ACCT = "bot"
+BOT_DOMAIN = "example.com"
+ACCOUNTS = ["alice", "bob@mastodon.social", "carol@fosstodon.org", "dave", "erin@hachyderm.io"]
+WORDS = (
+    "the quick brown fox jumps over lazy dog please remind me about this later "
+    "meeting notes weather today tomorrow coffee release deploy server bot thanks"
+).split()
+HASHTAGS = ["python", "mastodon", "fediverse", "opensource", "bots"]
+LINKS = [
+    ("https://", "docs.joinmastodon.org/", "methods/statuses/"),
+    ("https://", "github.com/slashtechno/", "pystodon"),
+    ("https://", "en.wikipedia.org/wiki/List", "_of_tz_database_time_zones"),
+]
+# Commands (and their arguments) the statuses invoke
+INVOCATIONS = [
+    ("#remindme", ["in 5 minutes", "in 1h30m", "tomorrow at 9:30", "in 2 days"]),
+    ("#timezone", ["America/New_York", "Europe/London", "Asia/Tokyo"]),
+    ("#weather", ["40.730610, -73.935242", "51.5072, -0.1276"]),
+    ("help", ["", "#remindme"]),
+    ("/test", [""]),
+]
+
+
+def mention(acct: str) -> str:
+    username = acct.split("@")[0]
+    domain = acct.split("@")[1] if "@" in acct else BOT_DOMAIN
+    return (
+        f'<span class="h-card" translate="no"><a href="https://{domain}/@{username}" class="u-url mention">'
+        f"@<span>{username}</span></a></span>"
+    )
+
+
+def hashtag(tag: str) -> str:
+    return (
+        f'<a href="https://{BOT_DOMAIN}/tags/{tag}" class="mention hashtag" rel="tag">#<span>{tag}</span></a>'
+    )
+
+
+def link(parts: tuple[str, str, str]) -> str:
+    scheme, visible, rest = parts
+    return (
+        f'<a href="{scheme}{visible}{rest}" target="_blank" rel="nofollow noopener noreferrer" translate="no">'
+        f'<span class="invisible">{scheme}</span><span class="ellipsis">{visible}</span>'
+        f'<span class="invisible">{rest}</span></a>'
+    )
+
+
+def sentence(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(4, 14))
+    # Mastodon escapes these in text
+    if rng.random() < 0.2:
+        words.append("&amp; &lt;3 &quot;quoted&quot;")
+    if rng.random() < 0.3:
+        words.append(hashtag(rng.choice(HASHTAGS)))
+    if rng.random() < 0.3:
+        words.append(link(rng.choice(LINKS)))
+    return " ".join(words)
+
+
+def content(rng: random.Random, command: str, argument: str) -> str:
+    """The HTML content of a status that mentions the bot and invokes a command, followed by some other paragraphs."""
+    first = f"{mention(BOT_ACCT)} {command} {argument}".rstrip()
+    if rng.random() < 0.3:
+        # Other accounts mentioned in the same status
+        first += " " + " ".join(mention(acct) for acct in rng.sample(ACCOUNTS, 2))
+    paragraphs = [first]
+    for _ in range(rng.randint(0, 3)):
+        lines = [sentence(rng) for _ in range(rng.randint(1, 3))]
+        paragraphs.append("<br />".join(lines))
+    return "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+
+
+def make_status(rng: random.Random, status_id: int, command: str = None, argument: str = None) -> dict:
+    """A status payload with the fields the bot reads. The command and argument are picked at random if not given."""
+    if command is None:
+        command, arguments = rng.choice(INVOCATIONS)
+        argument = rng.choice(arguments)
+    acct = rng.choice(ACCOUNTS)
+    return {
+        "id": str(status_id),
+        "created_at": datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc),
+        "in_reply_to_id": None,
+        "visibility": rng.choice(["public", "unlisted", "direct"]),
+        "content": content(rng, command, argument or ""),
+        "account": {
+            "id": str(ACCOUNTS.index(acct) + 1),
+            "username": acct.split("@")[0],
+            "acct": acct,
+            "display_name": acct.split("@")[0].title(),
+        },
+        "mentions": [{"acct": BOT_ACCT, "username": BOT_ACCT}],
+        "tags": [],
+    }
+
+
+def make_corpus(size: int = 200, seed: int = 0) -> list[dict]:
+    """Return size statuses, the same ones every time for the same seed."""
+    rng = random.Random(seed)
+    return [make_status(rng, 100000 + i) for i in range(size)]
+
+
+def make_notification(status: dict, notification_id: int) -> dict:
+    """A mention notification for a status."""
+    return {
+        "id": str(notification_id),
+        "type": "mention",
+        "created_at": status["created_at"],
+        "account": status["account"],
+        "status": status,
+    }
@@ -0,0 +1,50 @@
+"""
+Micro-benchmark for command dispatch.
+Compares looking a command up in the dispatch table against the old linear scan over Command._commands
+as the number of registered commands grows.
+
+Run with `poetry run python -m benchmarks.dispatch`
+"""
+
+import timeit
+
+from pystodon.lib.command import Command
+
+SIZES = [1, 10, 100, 500]
+NUMBER = 100_000
+
+
+def register(n: int) -> list[Command]:
+    """Replace the registry with n commands and return them."""
+    for c in list(Command._commands):
+        Command.delete_command(c)
+    commands = [
+        Command(command=f"#command{i}", function=lambda status: "", help_text="")
+        for i in range(n)
+    ]
+    for c in commands:
+        Command.add_command(c)
+    return commands
+
+
+def linear_scan(token: str):
+    """How parse_status used to find a command."""
+    for c in Command._commands:
+        if token == c.command:
+            return c
+    return None
+
+
+def main():
+    print(f"{'commands':>10} {'dispatch (ns)':>15} {'linear scan (ns)':>18}")
+    for n in SIZES:
+        register(n)
+        # The last command is the worst case for a linear scan
+        token = f"#command{n - 1}"
+        dispatch = timeit.timeit(lambda: Command.get_command(token), number=NUMBER)
+        scan = timeit.timeit(lambda: linear_scan(token), number=NUMBER)
+        print(f"{n:>10} {dispatch / NUMBER * 1e9:>15.0f} {scan / NUMBER * 1e9:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
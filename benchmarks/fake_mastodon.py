@@ -0,0 +1,392 @@
+"""
+A local stand-in for a Mastodon instance, for load testing the bot without a real one.
+It implements the endpoints pystodon uses:
+the user stream (server-sent events), /api/v1/instance (and v2), POST and DELETE /api/v1/statuses, and /api/v1/notifications.
+Mentions are injected with inject_mention(), and every reply is recorded along with when it arrived,
+so the time from a mention being streamed to the bot replying can be measured.
+
+Run on its own with `poetry run python -m benchmarks.fake_mastodon --port 3000 --rate 5`,
+then point the bot at it with `--mastodon-api-base-url http://127.0.0.1:3000`.
+"""
+
+from __future__ import annotations
+import argparse
+import datetime
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from benchmarks.corpus import BOT_ACCT, make_notification, make_status
+
+# How often (in seconds) an idle stream gets a heartbeat comment, like Mastodon's streaming server sends
+HEARTBEAT_INTERVAL = 10
+NOTIFICATIONS_LIMIT = 40
+NOTIFICATIONS_MAX_LIMIT = 80
+
+
+class Reply:
+    """A status the bot posted, and when it arrived."""
+
+    __slots__ = ("status", "in_reply_to_id", "token", "received")
+
+    def __init__(self, status: dict, in_reply_to_id: str | None, token: str | None, received: float):
+        self.status = status
+        self.in_reply_to_id = in_reply_to_id
+        self.token = token
+        self.received = received
+
+
+class FakeMastodon:
+    """
+    The fake instance's state, and the HTTP server that serves it.
+    Times are time.monotonic() values. Everything is guarded by a lock since each request is handled on its own thread.
+
+    If rate_limit is set, each access token can make that many requests per rate_limit_window seconds,
+    and gets a 429 after that, like Mastodon's rate limiting.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        max_characters: int = 500,
+        rate_limit: int = None,
+        rate_limit_window: int = 300,
+    ):
+        self.max_characters = max_characters
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        # Notifications in the order they were injected, which is also the order of their ids
+        self.notifications = []
+        self.injected = {}
+        self.replies = []
+        self.deleted = []
+        self.statuses = {}
+        self.requests = 0
+        self.rate_limited = 0
+        # Maps access tokens to (window start, requests made in the window)
+        self._windows = {}
+        self._streams = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._replied = threading.Condition(self._lock)
+        self._stream_connected = threading.Condition(self._lock)
+
+        self.server = ThreadingHTTPServer((host, port), FakeMastodonHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Close every stream and stop serving."""
+        self.drop_streams()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def next_id(self) -> str:
+        with self._lock:
+            return str(next(self._ids))
+
+    def wait_for_stream(self, timeout: float) -> bool:
+        """Wait until a client is connected to the user stream. Return whether one connected in time."""
+        with self._stream_connected:
+            return self._stream_connected.wait_for(lambda: self._streams, timeout=timeout)
+
+    def drop_streams(self):
+        """Disconnect every streaming client, like a restart of Mastodon's streaming server."""
+        with self._lock:
+            for stream in self._streams:
+                stream.put(None)
+
+    def inject_mention(self, status: dict) -> dict:
+        """Add a mention notification for a status and send it to every connected stream."""
+        with self._lock:
+            notification = make_notification(status, next(self._ids))
+            payload = "event: notification\ndata: " + json.dumps(notification, default=str) + "\n\n"
+            self.notifications.append(notification)
+            self.injected[status["id"]] = time.monotonic()
+            for stream in self._streams:
+                stream.put(payload)
+        return notification
+
+    def wait_for_replies(self, count: int, timeout: float) -> bool:
+        """Wait until at least count replies have been received. Return whether they were received in time."""
+        with self._replied:
+            return self._replied.wait_for(lambda: len(self.replies) >= count, timeout=timeout)
+
+    def latencies(self) -> list[float]:
+        """The time (in seconds) from each mention being streamed to the first reply to it."""
+        with self._lock:
+            first_replies = {}
+            for reply in self.replies:
+                if reply.in_reply_to_id in self.injected:
+                    first_replies.setdefault(reply.in_reply_to_id, reply.received)
+            return [received - self.injected[status_id] for status_id, received in first_replies.items()]
+
+    def check_rate_limit(self, token: str | None) -> tuple[bool, dict]:
+        """Count a request against a token's rate limit. Return whether it's allowed, and the X-RateLimit-* headers."""
+        with self._lock:
+            self.requests += 1
+            if self.rate_limit is None:
+                return True, {}
+            now = time.time()
+            start, used = self._windows.get(token, (now, 0))
+            if now - start >= self.rate_limit_window:
+                start, used = now, 0
+            allowed = used < self.rate_limit
+            if allowed:
+                used += 1
+            else:
+                self.rate_limited += 1
+            self._windows[token] = (start, used)
+        reset = datetime.datetime.fromtimestamp(start + self.rate_limit_window, datetime.timezone.utc)
+        return allowed, {
+            "X-RateLimit-Limit": str(self.rate_limit),
+            "X-RateLimit-Remaining": str(self.rate_limit - used),
+            "X-RateLimit-Reset": reset.isoformat(),
+        }
+
+    def instance(self) -> dict:
+        host = urlsplit(self.url).netloc
+        return {
+            "uri": host,
+            "domain": host,
+            "title": "Fake Mastodon",
+            "version": "4.2.0",
+            "urls": {"streaming_api": self.url},
+            "configuration": {
+                "urls": {"streaming": self.url},
+                "statuses": {"max_characters": self.max_characters, "max_media_attachments": 4},
+            },
+        }
+
+    def account(self) -> dict:
+        return {
+            "id": "1",
+            "username": BOT_ACCT,
+            "acct": BOT_ACCT,
+            "display_name": BOT_ACCT.title(),
+            "url": f"{self.url}/@{BOT_ACCT}",
+        }
+
+    def post_status(self, params: dict, token: str | None) -> dict:
+        status = {
+            "id": self.next_id(),
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "in_reply_to_id": params.get("in_reply_to_id"),
+            "visibility": params.get("visibility") or "public",
+            "content": f"<p>{params.get('status', '')}</p>",
+            "account": self.account(),
+            "mentions": [],
+            "tags": [],
+        }
+        with self._replied:
+            self.statuses[status["id"]] = status
+            self.replies.append(Reply(status, status["in_reply_to_id"], token, time.monotonic()))
+            self._replied.notify_all()
+        return status
+
+    def delete_status(self, status_id: str) -> dict | None:
+        with self._lock:
+            if (status := self.statuses.pop(status_id, None)) is not None:
+                self.deleted.append(status_id)
+            return status
+
+    def notifications_page(self, query: dict) -> tuple[list[dict], dict]:
+        """
+        Return a page of notifications, newest first, and the max_id and min_id for the next and previous pages.
+        Follows Mastodon's paging: max_id and since_id bound the page, and min_id returns the notifications right after it.
+        """
+        limit = min(int(query.get("limit", NOTIFICATIONS_LIMIT)), NOTIFICATIONS_MAX_LIMIT)
+        max_id = int(query["max_id"]) if query.get("max_id") else None
+        since_id = int(query["since_id"]) if query.get("since_id") else None
+        min_id = int(query["min_id"]) if query.get("min_id") else None
+        types = query.get("types[]")
+        with self._lock:
+            matching = [
+                n
+                for n in self.notifications
+                if (max_id is None or int(n["id"]) < max_id)
+                and (since_id is None or int(n["id"]) > since_id)
+                and (min_id is None or int(n["id"]) > min_id)
+                and (not types or n["type"] in types)
+            ]
+        # min_id pages forwards from the oldest, everything else pages backwards from the newest
+        page = matching[:limit] if min_id is not None else matching[-limit:]
+        page.reverse()
+        return page, {"max_id": page[-1]["id"], "min_id": page[0]["id"]} if page else {}
+
+    def add_stream(self) -> queue.Queue:
+        stream = queue.Queue()
+        with self._stream_connected:
+            self._streams.append(stream)
+            self._stream_connected.notify_all()
+        return stream
+
+    def remove_stream(self, stream: queue.Queue):
+        with self._lock:
+            if stream in self._streams:
+                self._streams.remove(stream)
+
+
+class FakeMastodonHandler(BaseHTTPRequestHandler):
+    """Routes requests to the FakeMastodon the server belongs to."""
+
+    # Keep-alive, so the bot's connection pool is exercised like it would be against a real instance
+    protocol_version = "HTTP/1.1"
+    # Headers and bodies are written separately, which Nagle's algorithm would delay by tens of milliseconds
+    disable_nagle_algorithm = True
+
+    @property
+    def fake(self) -> FakeMastodon:
+        return self.server.fake
+
+    def log_message(self, format, *args):
+        # Logging every request would slow the server down more than the bot
+        pass
+
+    def token(self) -> str | None:
+        authorization = self.headers.get("Authorization", "")
+        return authorization.removeprefix("Bearer ") or None
+
+    def params(self) -> dict:
+        """The query string and (for POST) the body, as a dict of single values (or lists, for keys ending with [])."""
+        url = urlsplit(self.path)
+        pairs = parse_qs(url.query)
+        if length := int(self.headers.get("Content-Length") or 0):
+            body = self.rfile.read(length).decode()
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                return {**{k: v if k.endswith("[]") else v[-1] for k, v in pairs.items()}, **json.loads(body)}
+            for key, values in parse_qs(body).items():
+                pairs.setdefault(key, []).extend(values)
+        return {key: values if key.endswith("[]") else values[-1] for key, values in pairs.items()}
+
+    def send_json(self, body, status: int = 200, headers: dict = None):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self, method: str):
+        path = urlsplit(self.path).path.rstrip("/")
+        params = self.params()
+        if path == "/api/v1/streaming/user":
+            return self.stream()
+        if path == "/api/v1/streaming/health":
+            data = b"OK"
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        allowed, headers = self.fake.check_rate_limit(self.token())
+        if not allowed:
+            return self.send_json({"error": "Too many requests"}, 429, headers)
+
+        if method == "GET" and path in ("/api/v1/instance", "/api/v2/instance"):
+            return self.send_json(self.fake.instance(), headers=headers)
+        if method == "GET" and path == "/api/v1/accounts/verify_credentials":
+            return self.send_json(self.fake.account(), headers=headers)
+        if method == "GET" and path == "/api/v1/notifications":
+            page, bounds = self.fake.notifications_page(params)
+            if bounds:
+                base = f"{self.fake.url}/api/v1/notifications"
+                query = {k: v for k, v in params.items() if k not in ("max_id", "min_id", "since_id")}
+                headers["Link"] = (
+                    f'<{base}?{urlencode({**query, "max_id": bounds["max_id"]}, doseq=True)}>; rel="next", '
+                    f'<{base}?{urlencode({**query, "min_id": bounds["min_id"]}, doseq=True)}>; rel="prev"'
+                )
+            return self.send_json(page, headers=headers)
+        if method == "POST" and path == "/api/v1/statuses":
+            return self.send_json(self.fake.post_status(params, self.token()), headers=headers)
+        if method == "DELETE" and path.startswith("/api/v1/statuses/"):
+            if (status := self.fake.delete_status(path.rsplit("/", 1)[1])) is None:
+                return self.send_json({"error": "Record not found"}, 404, headers)
+            return self.send_json(status, headers=headers)
+        return self.send_json({"error": "Record not found"}, 404, headers)
+
+    def stream(self):
+        """Send notifications as server-sent events until the stream is dropped or the client disconnects."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        stream = self.fake.add_stream()
+        try:
+            while True:
+                try:
+                    payload = stream.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    payload = ":thump\n"
+                if payload is None:
+                    self.wfile.write(b"0\r\n\r\n")
+                    break
+                data = payload.encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.fake.remove_stream(stream)
+            self.close_connection = True
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run a fake Mastodon instance that mentions the bot.")
+    argparser.add_argument("--host", default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=3000)
+    argparser.add_argument("--rate", type=float, default=1.0, help="Mentions injected per second")
+    argparser.add_argument("--rate-limit", type=int, help="Requests allowed per token per --rate-limit-window")
+    argparser.add_argument("--rate-limit-window", type=int, default=300)
+    args = argparser.parse_args()
+
+    fake = FakeMastodon(args.host, args.port, rate_limit=args.rate_limit, rate_limit_window=args.rate_limit_window)
+    fake.start()
+    print(f"Serving on {fake.url}; waiting for the bot to connect")
+    fake.wait_for_stream(timeout=None)
+    rng = random.Random(0)
+    start = time.monotonic()
+    try:
+        for i in itertools.count():
+            # Sleep until the next mention is due, so the rate doesn't drift
+            time.sleep(max(0.0, start + i / args.rate - time.monotonic()))
+            fake.inject_mention(make_status(rng, fake.next_id(), command="/test", argument=""))
+            if i % max(1, int(args.rate * 10)) == 0:
+                latencies = fake.latencies()
+                print(f"{i + 1} mentions, {len(fake.replies)} replies, {len(latencies)} answered")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Import time budget for starting the bot.
+Imports pystodon.__main__ in a fresh interpreter with `python -X importtime`, reports the slowest modules,
+and exits with a non-zero status if the import took longer than the budget
+or if a module that should only be imported when it's first needed was imported.
+benchmarks.suite runs the same check.
+
+Run with `poetry run python -m benchmarks.import_time [budget in milliseconds]`
+"""
+
+import subprocess
+import sys
+
+# Milliseconds. Most of this is mastodon.py, trio, and loguru, which are needed to start anyway.
+DEFAULT_BUDGET_MS = 400
+# Only needed by some commands (or some configurations), so they shouldn't be imported at startup
+LAZY_MODULES = ("bs4", "dateparser", "pytz", "airportsdata", "peewee", "httpx")
+RUNS = 5
+
+
+def import_times() -> dict[str, tuple[int, int]]:
+    """Return {module: (self microseconds, cumulative microseconds)} for one import of pystodon.__main__."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pystodon.__main__"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        times[module.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def check(budget_ms: float = DEFAULT_BUDGET_MS, file=sys.stdout) -> bool:
+    """Time importing pystodon.__main__, print a report to file, and return whether it was within budget without importing any LAZY_MODULES."""
+    # The fastest run is used, since the first run also pays for reading files from disk
+    runs = [import_times() for _ in range(RUNS)]
+    best = min(runs, key=lambda times: sum(self_us for self_us, _ in times.values()))
+    total_ms = sum(self_us for self_us, _ in best.values()) / 1000
+
+    print(f"Importing pystodon.__main__ took {total_ms:.1f}ms (budget {budget_ms:.0f}ms)", file=file)
+    print("Slowest modules (self time):", file=file)
+    for module, (self_us, cumulative_us) in sorted(
+        best.items(), key=lambda item: item[1][0], reverse=True
+    )[:10]:
+        print(f"  {module:<40} {self_us / 1000:>7.1f}ms self {cumulative_us / 1000:>7.1f}ms cumulative", file=file)
+
+    passed = True
+    if eager := [module for module in LAZY_MODULES if module in best]:
+        print(f"Imported at startup but should be lazy: {', '.join(eager)}", file=file)
+        passed = False
+    if total_ms > budget_ms:
+        print("Over budget", file=file)
+        passed = False
+    return passed
+
+
+def main():
+    budget_ms = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    sys.exit(0 if check(budget_ms) else 1)
+
+
+if __name__ == "__main__":
+    main()
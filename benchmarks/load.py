@@ -0,0 +1,200 @@
+"""
+End-to-end load test of the bot against a fake Mastodon instance (see benchmarks/fake_mastodon.py).
+Starts the fake instance, runs the bot (`python -m pystodon`) against it with the given worker configuration,
+injects mentions at a steady rate, and reports the time from each mention being streamed to the bot's reply
+(as percentiles) and the sustained reply throughput.
+
+Run with `poetry run python -m benchmarks.load --rate 50 --duration 30 --workers 8 [--output results.json]`
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.corpus import make_status
+from benchmarks.fake_mastodon import FakeMastodon
+
+REPOSITORY = Path(__file__).resolve().parent.parent
+# Commands registered by default (ones that don't need an API key or a database), weighted by how often they're invoked
+INVOCATIONS = [("/test", "", 3), ("#timezone", "America/New_York", 2), ("help", "", 1)]
+
+
+def percentile(values: list[float], p: float) -> float:
+    """The p-th percentile (0 to 100) of sorted values, interpolating between the closest ranks."""
+    if not values:
+        return float("nan")
+    rank = (len(values) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def start_bot(url: str, args: argparse.Namespace, log_path: Path) -> subprocess.Popen:
+    """Start the bot in a subprocess, in an empty directory so it doesn't pick up a .env file."""
+    # Don't let the environment turn on commands that call out to other services
+    environment = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith(("RC_", "POSTGRES_"))
+    }
+    environment["PYTHONPATH"] = os.pathsep.join(filter(None, [str(REPOSITORY), environment.get("PYTHONPATH")]))
+    command = [
+        sys.executable,
+        "-m",
+        "pystodon",
+        "--mastodon-access-token",
+        "load-test",
+        "--mastodon-api-base-url",
+        url,
+        "--workers",
+        str(args.workers),
+        "--queue-size",
+        str(args.queue_size),
+        "--queue-full-policy",
+        args.queue_full_policy,
+        "--post-rate",
+        str(args.post_rate),
+        "--post-burst",
+        str(args.post_burst),
+        "--processes",
+        str(args.processes),
+        "--log-level",
+        "WARNING",
+    ]
+    return subprocess.Popen(
+        command,
+        cwd=log_path.parent,
+        env=environment,
+        stdout=log_path.open("w"),
+        stderr=subprocess.STDOUT,
+    )
+
+
+def stop_bot(bot: subprocess.Popen, timeout: float = 30):
+    """Interrupt the bot like Ctrl+C would, killing it if it doesn't exit in time."""
+    if bot.poll() is not None:
+        return
+    bot.send_signal(signal.SIGINT)
+    try:
+        bot.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        bot.kill()
+        bot.wait()
+
+
+def inject(fake: FakeMastodon, count: int, rate: float, rng: random.Random):
+    """Inject count mentions at rate per second. The schedule is fixed, so a slow bot doesn't slow the injection down."""
+    commands, arguments, weights = zip(*INVOCATIONS)
+    start = time.monotonic()
+    for i in range(count):
+        time.sleep(max(0.0, start + i / rate - time.monotonic()))
+        index = rng.choices(range(len(commands)), weights=weights)[0]
+        fake.inject_mention(make_status(rng, fake.next_id(), command=commands[index], argument=arguments[index]))
+
+
+def run(args: argparse.Namespace) -> dict:
+    fake = FakeMastodon(rate_limit=args.server_rate_limit, rate_limit_window=args.server_rate_limit_window)
+    fake.start()
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = Path(directory) / "bot.log"
+        bot = start_bot(fake.url, args, log_path)
+        try:
+            if not fake.wait_for_stream(timeout=args.startup_timeout):
+                raise RuntimeError(f"The bot didn't connect to the stream:\n{log_path.read_text()[-2000:]}")
+            # Warm up (connections, imports, caches) before measuring
+            inject(fake, args.warmup, args.rate, rng)
+            fake.wait_for_replies(args.warmup, timeout=args.drain_timeout)
+            fake.injected.clear()
+            replies_before = len(fake.replies)
+
+            count = int(args.rate * args.duration)
+            start = time.monotonic()
+            inject(fake, count, args.rate, rng)
+            injected_for = time.monotonic() - start
+            fake.wait_for_replies(replies_before + count, timeout=args.drain_timeout)
+            latencies = sorted(fake.latencies())
+            last_reply = max((reply.received for reply in fake.replies[replies_before:]), default=start)
+        finally:
+            stop_bot(bot)
+            fake.stop()
+        bot_log = log_path.read_text()
+
+    elapsed = max(last_reply - start, 1e-9)
+    return {
+        "config": {
+            "workers": args.workers,
+            "queue_size": args.queue_size,
+            "queue_full_policy": args.queue_full_policy,
+            "post_rate": args.post_rate,
+            "post_burst": args.post_burst,
+            "rate": args.rate,
+            "duration": args.duration,
+            "server_rate_limit": args.server_rate_limit,
+        },
+        "mentions": count,
+        "answered": len(latencies),
+        "unanswered": count - len(latencies),
+        "injection_rate": count / injected_for if injected_for else float("inf"),
+        "throughput": len(latencies) / elapsed,
+        "latency_ms": {
+            f"p{p}": percentile(latencies, p) * 1000 for p in (50, 90, 95, 99)
+        }
+        | {"max": latencies[-1] * 1000 if latencies else float("nan")},
+        "server_requests": fake.requests,
+        "server_rate_limited": fake.rate_limited,
+        "bot_errors": sum(1 for line in bot_log.splitlines() if "ERROR" in line or "CRITICAL" in line),
+    }
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--rate", type=float, default=20, help="Mentions per second")
+    argparser.add_argument("--duration", type=float, default=15, help="How long (in seconds) to inject mentions for")
+    argparser.add_argument("--warmup", type=int, default=10, help="Mentions sent (and not measured) before the test")
+    argparser.add_argument("--workers", type=int, default=4)
+    argparser.add_argument("--queue-size", type=int, default=100)
+    argparser.add_argument("--queue-full-policy", default="block")
+    argparser.add_argument(
+        "--post-rate",
+        type=float,
+        default=1000,
+        help="The bot's --post-rate. High by default so the bot, rather than its pacing, is measured.",
+    )
+    argparser.add_argument("--post-burst", type=int, default=1000)
+    argparser.add_argument("--processes", type=int, default=0, help="Processes the bot uses for CPU-bound work")
+    argparser.add_argument(
+        "--server-rate-limit", type=int, help="Requests allowed per --server-rate-limit-window, like Mastodon's 300 per 5 minutes"
+    )
+    argparser.add_argument("--server-rate-limit-window", type=int, default=300)
+    argparser.add_argument("--startup-timeout", type=float, default=30)
+    argparser.add_argument("--drain-timeout", type=float, default=30, help="How long to wait for the last replies")
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--output", "-o", help="Also write the results as JSON to this file")
+    args = argparser.parse_args()
+
+    results = run(args)
+    latency = results["latency_ms"]
+    print(
+        f"{results['answered']}/{results['mentions']} mentions answered "
+        f"({results['unanswered']} unanswered, {results['bot_errors']} errors logged)"
+    )
+    print(f"Throughput: {results['throughput']:.1f} replies/s (injected at {results['injection_rate']:.1f}/s)")
+    print(
+        "Latency: "
+        + ", ".join(f"{name} {value:.1f}ms" for name, value in latency.items())
+    )
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Benchmark suite for the command pipeline.
+Runs the hot paths over a synthetic corpus of statuses (see benchmarks/corpus.py) and writes the results as JSON,
+so runs from different releases can be compared.
+
+Run with `poetry run python -m benchmarks.suite [--output results.json] [--compare baseline.json]`
+With --compare, the results are compared against an earlier run and the exit status is non-zero if any benchmark
+got slower by more than --threshold.
+The startup import time is checked too (see benchmarks/import_time.py), and the exit status is non-zero if it's over --import-budget.
+"""
+
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks import import_time
+from benchmarks.corpus import make_corpus, make_status
+from pystodon import commands
+from pystodon.lib import timezones, utils
+from pystodon.lib.command import Command
+from pystodon.lib.status import ParsedStatus
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str):
+    """
+    Register a benchmark.
+    The decorated function does any setup and returns (run, operations), where run() performs operations operations.
+    It can also return a third item, a function that cleans up after the benchmark.
+    """
+
+    def decorator(function: callable) -> callable:
+        BENCHMARKS[name] = function
+        return function
+
+    return decorator
+
+
+def measure(run: callable, operations: int, repeat: int, min_time: float) -> dict:
+    """
+    Call run() enough times to take at least min_time seconds, repeat times over, and return statistics in nanoseconds per operation.
+    The first call is a warm up and isn't counted.
+    """
+    run()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        if (elapsed := time.perf_counter() - start) >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    samples = [elapsed]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            run()
+        samples.append(time.perf_counter() - start)
+    per_operation = [sample / (loops * operations) * 1e9 for sample in samples]
+    return {
+        "median_ns": statistics.median(per_operation),
+        "min_ns": min(per_operation),
+        "mean_ns": statistics.fmean(per_operation),
+        "stdev_ns": statistics.stdev(per_operation) if len(per_operation) > 1 else 0.0,
+        "operations": loops * operations * repeat,
+    }
+
+
+def register_commands(n: int) -> Command | None:
+    """Replace the registered commands with n commands and return the last one registered (None if n is 0)."""
+    for c in list(Command._commands):
+        Command.delete_command(c)
+    for i in range(n):
+        Command.add_command(
+            Command(command=f"#command{i}", function=lambda status: "done", help_text=f"Command {i}")
+        )
+    return Command._commands[-1] if n else None
+
+
+CORPUS = make_corpus()
+
+
+@benchmark("parse_html")
+def parse_html():
+    contents = [status["content"] for status in CORPUS]
+    return (lambda: [utils.parse_html(content) for content in contents]), len(contents)
+
+
+@benchmark("return_raw_argument")
+def return_raw_argument():
+    return (lambda: [utils.return_raw_argument(status) for status in CORPUS]), len(CORPUS)
+
+
+def dispatch(n: int):
+    last = register_commands(n)
+    # The corpus' content, but invoking the last command registered
+    rng = random.Random(n)
+    statuses = [make_status(rng, i, command=last.command, argument="some argument") for i in range(len(CORPUS))]
+    return (
+        lambda: [Command.parse_status(status, always_mention=True) for status in statuses],
+        len(statuses),
+        lambda: register_commands(0),
+    )
+
+
+for n in (1, 50, 500):
+    benchmark(f"dispatch_{n}")(lambda n=n: dispatch(n))
+
+
+@benchmark("dispatch_miss_50")
+def dispatch_miss():
+    """Statuses that don't invoke any registered command (such as replies in a thread)."""
+    register_commands(50)
+    rng = random.Random(0)
+    statuses = [make_status(rng, i, command="thanks", argument="so much!") for i in range(len(CORPUS))]
+    return (
+        lambda: [Command.parse_status(status, always_mention=True) for status in statuses],
+        len(statuses),
+        lambda: register_commands(0),
+    )
+
+
+@benchmark("help_list_50")
+def help_list():
+    register_commands(50)
+    status = ParsedStatus.from_status(make_status(random.Random(0), 1, command="help", argument=""))
+    return (lambda: Command.help_command(status)), 1, lambda: register_commands(0)
+
+
+@benchmark("help_list_50_uncached")
+def help_list_uncached():
+    """Building the list of commands, which help_list_50 only does once since the response is cached."""
+    register_commands(50)
+    return (lambda: Command.help_text_for(None)), 1, lambda: register_commands(0)
+
+
+@benchmark("help_command_50")
+def help_command():
+    last = register_commands(50)
+    status = ParsedStatus.from_status(make_status(random.Random(0), 1, command="help", argument=last.command))
+    return (lambda: Command.help_command(status)), 1, lambda: register_commands(0)
+
+
+@benchmark("timezone")
+def timezone():
+    rng = random.Random(0)
+    zones = ["America/New_York", "Europe/London", "Asia/Tokyo", "Australia/Sydney"]
+    statuses = [make_status(rng, i, command="#timezone", argument=rng.choice(zones)) for i in range(len(CORPUS))]
+    return (lambda: [commands.timezone(status) for status in statuses]), len(statuses)
+
+
+@benchmark("timezone_lookup")
+def timezone_lookup():
+    """Resolving a mix of zone names (in any case), airport codes, and cities with the timezone index."""
+    index = timezones.get_index()
+    queries = ["America/New_York", "europe/london", "Asia/Tokyo", "LHR", "KSFO", "jfk", "Paris", "new york", "Sydney", "nowhere"]
+    return (lambda: [index.tzinfo(query) for query in queries]), len(queries)
+
+
+@benchmark("timezone_index_load")
+def timezone_index_load():
+    """Loading the timezone index from its cache file, which happens the first time #timezone is used."""
+    directory = tempfile.TemporaryDirectory()
+    timezones.TimezoneIndex.load(Path(directory.name))
+    return (lambda: timezones.TimezoneIndex.load(Path(directory.name))), 1, directory.cleanup
+
+
+@benchmark("timezone_cached")
+def timezone_cached():
+    """#timezone dispatched with the response cache it's registered with in main(), for already-parsed statuses."""
+    register_commands(0)
+    Command.add_command(
+        Command(
+            command="#timezone",
+            function=commands.timezone,
+            help_text="",
+            cache_ttl=1,
+            cache_key=commands.timezone_cache_key,
+        )
+    )
+    rng = random.Random(0)
+    zones = ["America/New_York", "Europe/London", "Asia/Tokyo", "Australia/Sydney"]
+    statuses = [
+        ParsedStatus(make_status(rng, i, command="#timezone", argument=rng.choice(zones)))
+        for i in range(len(CORPUS))
+    ]
+    return (
+        lambda: [Command.parse_status(status, always_mention=True) for status in statuses],
+        len(statuses),
+        lambda: register_commands(0),
+    )
+
+
+def sqlite_storage(directory: str):
+    # Only imported for the reminder benchmarks, like in main()
+    from pystodon.lib.storage import SqliteReminderStorage
+
+    storage = SqliteReminderStorage(str(Path(directory) / "reminders.db"))
+    storage.setup()
+    return storage
+
+
+@benchmark("reminder_insert_sqlite")
+def reminder_insert():
+    directory = tempfile.TemporaryDirectory()
+    storage = sqlite_storage(directory.name)
+    due = datetime.datetime.now() + datetime.timedelta(days=1)
+
+    def cleanup():
+        storage.close()
+        directory.cleanup()
+
+    return (lambda: storage.add("1", "alice", "public", due)), 1, cleanup
+
+
+@benchmark("reminder_poll_sqlite")
+def reminder_poll():
+    """Loading the look-ahead window from a table of 10,000 reminders, 100 of which are in the window."""
+    directory = tempfile.TemporaryDirectory()
+    storage = sqlite_storage(directory.name)
+    now = datetime.datetime.now()
+    from pystodon.lib.storage import RelativeReminder
+
+    with storage.database.connection_context(), storage.database.atomic():
+        RelativeReminder.insert_many(
+            [
+                {
+                    "status_id": str(i),
+                    "acct": "alice",
+                    "visibility": "public",
+                    # Every 100th reminder is in the next hour, the rest are days away
+                    "datetime": now
+                    + (
+                        datetime.timedelta(minutes=i % 60)
+                        if i % 100 == 0
+                        else datetime.timedelta(days=2 + i % 30)
+                    ),
+                }
+                for i in range(10_000)
+            ]
+        ).execute()
+    until = now + commands.RemindMe.lookahead
+
+    def cleanup():
+        storage.close()
+        directory.cleanup()
+
+    return (lambda: storage.upcoming(until)), 1, cleanup
+
+
+@benchmark("reminder_claim_sqlite")
+def reminder_claim():
+    """Inserting a due reminder and claiming it, which is what happens every time a reminder fires."""
+    directory = tempfile.TemporaryDirectory()
+    storage = sqlite_storage(directory.name)
+    due = datetime.datetime.now() - datetime.timedelta(seconds=1)
+
+    def run():
+        storage.claim([storage.add("1", "alice", "public", due)])
+
+    def cleanup():
+        storage.close()
+        directory.cleanup()
+
+    return run, 1, cleanup
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "corpus_size": len(CORPUS),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """
+    Print how each benchmark changed since the baseline and return whether any got slower by more than threshold.
+    The fastest timings are compared, since they're the least affected by whatever else the machine is doing.
+    """
+    regressed = False
+    print(f"{'benchmark':<26} {'baseline (ns)':>14} {'now (ns)':>12} {'change':>9}", file=sys.stderr)
+    for name, result in results.items():
+        if (old := baseline["results"].get(name)) is None:
+            print(f"{name:<26} {'-':>14} {result['min_ns']:>12.0f} {'new':>9}", file=sys.stderr)
+            continue
+        change = result["min_ns"] / old["min_ns"] - 1
+        flag = ""
+        if change > threshold:
+            regressed = True
+            flag = " REGRESSION"
+        print(
+            f"{name:<26} {old['min_ns']:>14.0f} {result['min_ns']:>12.0f} {change:>+8.1%}{flag}",
+            file=sys.stderr,
+        )
+    return regressed
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    argparser.add_argument("--output", "-o", help="Write the JSON results to this file instead of stdout")
+    argparser.add_argument("--compare", help="Compare against the JSON results of an earlier run")
+    argparser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="How much slower (as a fraction of the baseline) counts as a regression",
+    )
+    argparser.add_argument("--repeat", type=int, default=5, help="How many times each benchmark is timed")
+    argparser.add_argument(
+        "--min-time", type=float, default=0.2, help="The minimum time (in seconds) each timing should take"
+    )
+    argparser.add_argument("--filter", "-k", help="Only run benchmarks (and the import time check) whose name contains this")
+    argparser.add_argument(
+        "--import-budget",
+        type=float,
+        default=import_time.DEFAULT_BUDGET_MS,
+        help="How long (in milliseconds) importing the bot is allowed to take",
+    )
+    args = argparser.parse_args()
+    # Don't let warnings from the storage backends and the logger get mixed into the results
+    from loguru import logger
+
+    logger.remove()
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        run, operations, *cleanup = setup()
+        try:
+            results[name] = measure(run, operations, args.repeat, args.min_time)
+        finally:
+            for function in cleanup:
+                function()
+        print(f"{name:<26} {results[name]['median_ns']:>12.0f} ns/op", file=sys.stderr)
+
+    failed = False
+    if not args.filter or args.filter in "import_time":
+        failed = not import_time.check(args.import_budget, file=sys.stderr)
+
+    output = json.dumps({"metadata": metadata(), "results": results}, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        failed = compare(results, baseline, args.threshold) or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
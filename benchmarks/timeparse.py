@@ -0,0 +1,72 @@
+"""
+Benchmark for parsing #remindme time expressions.
+Compares the fast path in pystodon.lib.timeparse against dateparser over a corpus of real-looking inputs,
+with both caches cleared so every call does the full parse.
+
+Run with `poetry run python -m benchmarks.timeparse`
+"""
+
+import datetime
+import time
+
+from pystodon.lib import timeparse
+
+CORPUS = [
+    "in 5 minutes",
+    "in 10 mins",
+    "in 1h30m",
+    "in 2 hours",
+    "in an hour",
+    "in a day",
+    "in 3 days",
+    "in 1 week",
+    "in 45 seconds",
+    "in 1 hour and 15 minutes",
+    "in 2h 30m",
+    "in 20m",
+    "tomorrow",
+    "tomorrow at 9:30",
+    "tomorrow at 5pm",
+    "today at 18:00",
+    "2026-12-01T10:00:00",
+    "2026-12-01 10:00",
+    "2026-12-01T10:00:00+02:00",
+]
+ROUNDS = 20
+
+
+def time_per_call(parse: callable) -> float:
+    """Return the mean time (in microseconds) per expression, parsing the corpus ROUNDS times."""
+    now = datetime.datetime(2026, 10, 17, 12, 0, 0)
+    start = time.perf_counter()
+    for round_ in range(ROUNDS):
+        for text in CORPUS:
+            parse(text, now + datetime.timedelta(seconds=round_))
+    return (time.perf_counter() - start) / (ROUNDS * len(CORPUS)) * 1e6
+
+
+def fast_path(text: str, now: datetime.datetime):
+    timeparse.parse_recipe.cache_clear()
+    return timeparse.parse_time(text, now)
+
+
+def dateparser_only(text: str, now: datetime.datetime):
+    timeparse.parse_with_dateparser.cache_clear()
+    return timeparse.parse_with_dateparser(text, now)
+
+
+def main():
+    start = time.perf_counter()
+    import dateparser  # noqa: F401
+
+    print(f"Importing dateparser: {(time.perf_counter() - start) * 1e3:.0f} ms")
+    # Warm up dateparser, which loads its language data on the first parse
+    dateparser_only("in 5 minutes", datetime.datetime.now())
+    print(f"{'path':>20} {'per call (us)':>15}")
+    print(f"{'fast path':>20} {time_per_call(fast_path):>15.1f}")
+    print(f"{'fast path (cached)':>20} {time_per_call(timeparse.parse_time):>15.1f}")
+    print(f"{'dateparser':>20} {time_per_call(dateparser_only):>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,76 @@
-import httpx
+import sys
+
 from . import commands
-from peewee import PostgresqlDatabase
 
 
+from pystodon.lib.accounts import DEFAULT_ACCOUNT, Account, load_accounts
+from pystodon.lib.clients import MastodonClients
 from pystodon.lib.command import Command, CheckThis
-from pystodon.lib import utils
-from pystodon.utils.logging import logger
-from pystodon.utils.cli_args import args
+from pystodon.lib import metrics, profiling, utils
+from pystodon.lib.processes import ProcessPool
+from pystodon.utils.logging import logger, set_primary_logger
+from pystodon.utils import cli_args
 
 # Global variables
 posts_to_delete = []
 
 
 def main():
-    commands.RemindMe.mastodon_access_token = args.mastodon_access_token
-    commands.RemindMe.mastodon_api_base_url = args.mastodon_api_base_url
+    # Arguments are parsed once, here, rather than when pystodon is imported
+    args = cli_args.set_argparse()
+    set_primary_logger(args.log_level)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port, host=args.metrics_host)
+        logger.info(f"Serving metrics on http://{args.metrics_host}:{args.metrics_port}/metrics")
+    # Also used by commands added with profile=True, even if --profile isn't set
+    profiling.PROFILER.directory = args.profile_dir
+    profiling.PROFILER.flush_interval = args.profile_interval
+    profiling.PROFILER.sample_interval = args.profile_sample_interval
+    if args.profile:
+        profiling.PROFILER.profile_all = True
+        profiling.PROFILER.start()
+    if args.processes > 0:
+        # Started before any mentions arrive so the first burst doesn't wait for the processes to start
+        ProcessPool.start(args.processes)
+
+    # Serve every account in the accounts file from this process, or the single account from the arguments
+    if args.accounts_file is not None:
+        try:
+            accounts = load_accounts(
+                args.accounts_file,
+                state_path=args.state_path,
+                delete_journal_path=args.delete_journal_path,
+            )
+        except (OSError, ValueError) as e:
+            logger.critical(f"Couldn't load the accounts in {args.accounts_file}: {e}")
+            sys.exit(1)
+    else:
+        accounts = [
+            Account(
+                name=DEFAULT_ACCOUNT,
+                access_token=args.mastodon_access_token,
+                api_base_url=args.mastodon_api_base_url,
+                state_path=args.state_path,
+                delete_journal_path=args.delete_journal_path,
+            )
+        ]
+    # Every account's client shares one session, so accounts on the same instance share its keep-alive connections
+    # Each worker may be posting at the same time, and each account's stream holds a connection open
+    session = MastodonClients.pooled_session(
+        pool_maxsize=max(10, (args.workers + 1) * len(accounts)),
+        hosts=len({account.api_base_url.rstrip("/") for account in accounts}),
+    )
+    # One client per account is shared by its stream listener, reminders, and commands
+    clients = {}
+    for account in accounts:
+        clients[account.name] = MastodonClients.get(
+            access_token=account.access_token,
+            api_base_url=account.api_base_url,
+            session=session,
+        )
+        # Create the account's Outbox with the configured pacing before anything else asks for it
+        # Each account has its own, so one account's rate limit doesn't hold up the others
+        MastodonClients.outbox(clients[account.name], rate=args.post_rate, burst=args.post_burst)
 
     # If the weather API key is set, check if it's valid
     # If it's valid, add the weather command
@@ -26,30 +82,52 @@ def main():
                     command="#weather",
                     function=commands.weather,
                     help_text="Get the weather for a location. Pass the latitude and longitude as arguments. For example, `@bot@example.com #weather 40.730610, -73.935242`",
+                    # weather is async, so it's awaited in the Trio loop and gives up if the API doesn't answer in time
+                    timeout=15,
+                    # The weather for a location changes over minutes, so popular locations skip the API (and the parsing)
+                    cache_ttl=60,
                     # Pass this kwarg
                     weather_api_key=args.weather_api_key,
                 )
             )
         else:
             logger.error("Weather API key is invalid; not adding weather command")
-    # Check if the database args are set and add the command(s) that require the database
-    # postgres_db, postgres_user, postgres_password, postgres_host, and postgres_port are set
-    if (
+    # Pick where reminders are stored and add the command(s) that require the database
+    # If a backend isn't specified, Postgres is used if postgres_db, postgres_user, postgres_password, postgres_host, and postgres_port are set
+    reminder_storage = args.reminder_storage
+    if reminder_storage is None and (
         args.postgres_db
         and args.postgres_user
         and args.postgres_password
         and args.postgres_host
         and args.postgres_port
     ):
-        logger.info("Database args are set; adding commands that require the database")
-        pg_db = PostgresqlDatabase(
-            args.postgres_db,
-            user=args.postgres_user,
-            password=args.postgres_password,
-            host=args.postgres_host,
-            port=args.postgres_port,
+        reminder_storage = "postgres"
+    if reminder_storage is not None:
+        logger.info(
+            f"Storing reminders in {reminder_storage}; adding commands that require the database"
         )
-        commands.peewee_proxy.initialize(pg_db)
+        # The storage backends (and peewee) are only imported if reminders are enabled
+        from pystodon.lib.storage import PostgresReminderStorage, SqliteReminderStorage
+
+        if reminder_storage == "postgres":
+            commands.RemindMe.storage = PostgresReminderStorage(
+                args.postgres_db,
+                user=args.postgres_user,
+                password=args.postgres_password,
+                host=args.postgres_host,
+                port=args.postgres_port,
+                max_connections=args.postgres_max_connections,
+                stale_timeout=args.postgres_stale_timeout,
+            )
+        else:
+            commands.RemindMe.storage = SqliteReminderStorage(args.sqlite_path)
+        # Create and migrate the schema once, instead of checking on every command
+        commands.RemindMe.storage.setup()
+        # Reminders are fired by an in-memory timer, so this only needs to run when one is due
+        # The interval is a fallback since remind() returns how long to wait
+        commands.RemindMe.check = CheckThis(function=commands.remind, interval=60)
+        CheckThis.add_check(commands.RemindMe.check)
         Command.add_command(
             Command(
                 command="#remindme",
@@ -58,9 +136,6 @@ def main():
             )
         )
 
-    # Setup checks
-    CheckThis.add_check(CheckThis(function=commands.remind, interval=5))
-
     # Setup commands
     # Test command that returns "test"
     Command.add_command(
@@ -74,25 +149,45 @@ def main():
         Command(
             command="#timezone",
             function=commands.timezone,
-            help_text="Get the time in a timezone. Pass the timezone (https://en.wikipedia.org/wiki/List_of_tz_database_time_zones) as an argument. For example, `@bot@example.com #timezone America/New_York`",
+            # Responses only change once a second
+            cache_ttl=1,
+            cache_key=commands.timezone_cache_key,
+            help_text="Get the time in a timezone. Pass the timezone (https://en.wikipedia.org/wiki/List_of_tz_database_time_zones), an airport code, or a city as an argument. For example, `@bot@example.com #timezone America/New_York` or `@bot@example.com #timezone LHR`",
         )
     )
 
-    stream_listener = utils.stream_listener(
-        mastodon_access_token=args.mastodon_access_token,
-        mastodon_api_base_url=args.mastodon_api_base_url,
-        delete_when_done=args.delete_posts_after_run,
-        always_mention=args.always_mention,
-    )
-    stream_listener.stream()
+    # Commands and the scheduler are shared, while each account has its own queue, workers, state, and posts to delete
+    stream_listeners = [
+        utils.stream_listener(
+            mastodon_access_token=account.access_token,
+            mastodon_api_base_url=account.api_base_url,
+            delete_when_done=args.delete_posts_after_run,
+            always_mention=args.always_mention,
+            workers=args.workers,
+            queue_size=args.queue_size,
+            queue_full_policy=args.queue_full_policy,
+            instance_cache_ttl=args.instance_cache_ttl,
+            state_path=account.state_path,
+            delete_journal_path=account.delete_journal_path,
+            delete_concurrency=args.delete_concurrency,
+            mastodon=clients[account.name],
+            name=account.name,
+        )
+        for account in accounts
+    ]
+    if len(stream_listeners) > 1:
+        logger.info(f"Serving {len(stream_listeners)} accounts: {', '.join(account.name for account in accounts)}")
+    try:
+        utils.stream_all(stream_listeners)
+    finally:
+        ProcessPool.shutdown()
 
 
 def check_if_weather_api_key_is_valid(key: str):
     """If an API key works, set the class API key."""
     # Test API key to make sure it works
     params = {"key": key, "aqi": "no", "q": "London"}
-    url = "https://api.weatherapi.com/v1/current.json"
-    response = httpx.get(url=url, params=params)
+    response = commands.get_http_client().get(url=commands.WEATHER_API_URL, params=params)
     if response.status_code == 200:
         return True
     elif response.status_code == 403:
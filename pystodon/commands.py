@@ -1,158 +1,327 @@
+from __future__ import annotations
+import heapq
 import re
-import pytz
+import threading
+import time
 import datetime
-from pystodon.lib import utils
-import httpx
-import dateparser
-from mastodon import Mastodon
-
-# https://docs.peewee-orm.com/en/latest/peewee/quickstart.html
-# https://docs.peewee-orm.com/en/latest/peewee/models.html#field-types-table
-import peewee
-import json
-
-# https://stackoverflow.com/a/45043715
-# https://timlehr.com/2018/01/lazy-database-initialization-with-peewee-proxy-subclasses/
-peewee_proxy = peewee.Proxy()
-
+from typing import TYPE_CHECKING
 
-class RelativeReminder(peewee.Model):
-    """
-    A class to represent a reminder that stores a status dict and a datetime
-    """
+import trio
+from loguru import logger
+from pystodon.lib import utils
+from pystodon.lib.accounts import CURRENT_ACCOUNT, DEFAULT_ACCOUNT
+from pystodon.lib.status import ParsedStatus
 
-    status = peewee.TextField()
-    datetime = peewee.DateTimeField()
+from pystodon.lib import timezones
+from pystodon.lib.cache import TTLCache
+from pystodon.lib.metrics import REMINDERS_SENT
+from pystodon.lib.timeparse import parse_time
 
-    class Meta:
-        database = peewee_proxy
+# pytz, airportsdata (through the timezone index), httpx, and peewee (through the storage backends) are slow to import and only needed by some commands,
+# so they're imported when they're first used instead of when the bot starts
+if TYPE_CHECKING:
+    import httpx
+    from pystodon.lib.storage import ReminderStorage
 
 
 class RemindMe:
     """Functions related to reminding the user of posts"""
 
     help_text = 'Remind you of a post in a specified time. For example, posting/replying with "@bot@example.com #remindme in 5 minutes" will remind you in 5 minutes. Whilst it may work without it, it is recommended to specify "in" before the time. Dateparser is used to parse the time, so it should be able to understand various formats. For more information, see https://dateparser.readthedocs.io/en/latest/'
+    # Where reminders are stored, set by main() to one of the ReminderStorage backends
+    storage: ReminderStorage = None
+
+    # Reminders due within the look-ahead window are kept in an in-memory timer (a heap of (due, reminder id)),
+    # so the database is only queried when a reminder is due or the window is reloaded
+    lookahead = datetime.timedelta(hours=1)
+    # How often the window is reloaded, which picks up reminders added by other processes
+    reload_interval = datetime.timedelta(minutes=1)
+    _timer = []
+    _timer_ids = set()
+    _loaded_at = None
+    # remind_me_in runs on worker threads while remind() runs in the scheduler
+    _timer_lock = threading.Lock()
+    # The CheckThis that runs remind(). If it's set, adding a reminder wakes it up so the timer is rechecked.
+    check = None
 
     @staticmethod
-    def remind_me_in(status: dict):
+    def remind_me_in(status: dict | ParsedStatus):
         """
         Add the current status and the time to a database.
         """
-        dt = dateparser.parse(utils.return_raw_argument(status))
+        status = ParsedStatus.from_status(status)
+        # Common forms ("in 5 minutes", "tomorrow at 9:30") are parsed quickly, and anything else is passed to dateparser
+        dt = parse_time(status.argument)
         if dt is None:
             return "Invalid time. For more information, see https://dateparser.readthedocs.io/en/latest/"
-        # Make it so the datetime only goes to the minute (no seconds or lower denominations)
-        dt = dt.replace(second=0, microsecond=0)
-        # Add the reminder to the database
-        # If the table doesn't exist, create it)
-        peewee_proxy.connect()
-        if not RelativeReminder.table_exists():
-            peewee_proxy.create_tables([RelativeReminder])
-        RelativeReminder(status=json.dumps(status, default=str), datetime=dt).save()
-        peewee_proxy.close()
+        # Reminders are delivered to the second, so anything smaller is dropped
+        dt = dt.replace(microsecond=0)
+        # Add the reminder to the database, under the account that was mentioned so that account posts it
+        # The table is created at startup by ReminderStorage.setup()
+        reminder_id = RemindMe.storage.add(
+            status_id=str(status["id"]),
+            acct=status["account"]["acct"],
+            visibility=status["visibility"],
+            due=dt,
+            account=CURRENT_ACCOUNT.get(),
+        )
+        RemindMe.add_to_timer(reminder_id, dt)
         return f"Reminder set for {dt.strftime('%Y-%m-%d %H:%M:%S')}"
 
     @staticmethod
-    def list_reminders():
+    def served_accounts() -> list[str]:
+        """
+        The names of the bot accounts this process is serving.
+        Only their reminders are loaded and claimed; the rest are left in the database for whichever process serves them.
+        """
+        return list(utils.stream_listener.accounts)
+
+    @classmethod
+    def add_to_timer(cls, reminder_id: int, due: datetime.datetime):
         """
-        Check the database for reminders that are due.
+        Add a reminder to the in-memory timer if it's due within the loaded window.
+        Reminders due later are picked up when the window is reloaded.
         """
-        # Check all reminders that match the current date (to the minute)
-        now = datetime.datetime.now().replace(second=0, microsecond=0)
-        peewee_proxy.connect()
-        try:
-            # Select all columns where the datetime is now
-            for reminder in RelativeReminder.select().where(
-                RelativeReminder.datetime == now
-            ):
-                status = json.loads(reminder.status)
-                # Return the status
-                yield status
-                # Delete the reminder
-                reminder.delete_instance()
-        except peewee.ProgrammingError as e:
-            if "does not exist" in str(e):
-                peewee_proxy.close()
+        with cls._timer_lock:
+            if cls._loaded_at is None or due > cls._loaded_at + cls.lookahead:
                 return
-            else:
-                raise e
-        peewee_proxy.close()
+            if reminder_id not in cls._timer_ids:
+                cls._timer_ids.add(reminder_id)
+                heapq.heappush(cls._timer, (due, reminder_id))
+        if cls.check is not None:
+            cls.check.run_soon()
+
+    @classmethod
+    def load_upcoming(cls, now: datetime.datetime):
+        """Load the reminders due before the end of the look-ahead window (including overdue ones) into the timer."""
+        upcoming = cls.storage.upcoming(now + cls.lookahead, cls.served_accounts())
+        with cls._timer_lock:
+            for reminder_id, due in upcoming:
+                if reminder_id not in cls._timer_ids:
+                    cls._timer_ids.add(reminder_id)
+                    heapq.heappush(cls._timer, (due, reminder_id))
+            cls._loaded_at = now
+
+    @classmethod
+    def pop_due(cls, now: datetime.datetime) -> list[int]:
+        """Remove and return the ids of reminders in the timer that are due at or before now."""
+        due = []
+        with cls._timer_lock:
+            while cls._timer and cls._timer[0][0] <= now:
+                _, reminder_id = heapq.heappop(cls._timer)
+                cls._timer_ids.discard(reminder_id)
+                due.append(reminder_id)
+        return due
+
+    @classmethod
+    def claim_reminders(cls, reminder_ids: list[int]):
+        """
+        Delete reminders by id, yielding the status each one should reply to.
+        Reminders that were already claimed (for example, by another process) are skipped.
+        The yielded dicts only have the fields needed to reply (id, account.acct, and visibility),
+        along with bot_account, the name of the bot account that should post the reminder.
+        """
+        for status_id, acct, visibility, account in cls.storage.claim(reminder_ids, cls.served_accounts()):
+            yield {
+                "id": status_id,
+                "account": {"acct": acct},
+                "visibility": visibility,
+                "bot_account": account,
+            }
+
+    @classmethod
+    def seconds_until_next(cls, now: datetime.datetime) -> float:
+        """Return how long until the next reminder in the timer is due or the window needs to be reloaded, whichever is sooner."""
+        with cls._timer_lock:
+            next_run = cls._loaded_at + cls.reload_interval
+            if cls._timer:
+                next_run = min(next_run, cls._timer[0][0])
+        return max(0.0, (next_run - now).total_seconds())
 
     @classmethod
     def remind_user(cls, status: dict):
         """
-        Remind the user of a post.
+        Remind the user of a post, posting as the bot account the reminder was set with (through its Outbox, so it's rate limited with the account's other posts).
+        Only reminders for accounts that are being served are claimed, so the account's listener should always be found.
         """
-        mastodon = Mastodon(
-            access_token=cls.mastodon_access_token,
-            api_base_url=cls.mastodon_api_base_url,
-        )
+        name = status.get("bot_account", DEFAULT_ACCOUNT)
+        if (listener := utils.stream_listener.accounts.get(name)) is None:
+            logger.error(f"Couldn't send the reminder for status {status['id']}, since the account it was set with ({name}) isn't being served")
+            return False
         content = f"@{status['account']['acct']}\nHere's your reminder!"
-        post = mastodon.status_post(
+        listener.outbox.submit(
+            "status_post",
             status=content,
             in_reply_to_id=status["id"],
             visibility=status["visibility"],
+            # Tracked to be deleted along with the account's other posts, if they're being deleted
+            callback=listener.posted,
         )
-        utils.stream_listener.partially_configured_stream_listener.posts_to_delete.append(post["id"])
-
+        return True
 
-    # Getters and setters for mastodon_api_base_url and mastodon_access_token
-    @property
-    def mastodon_api_base_url(cls):
-        return cls._mastodon_api_base_url
 
-    @mastodon_api_base_url.setter
-    def mastodon_api_base_url(cls, value):
-        cls._mastodon_api_base_url = value
-
-    @property
-    def mastodon_access_token(cls):
-        return cls._mastodon_access_token
-
-    @mastodon_access_token.setter
-    def mastodon_access_token(cls, value):
-        cls._mastodon_access_token = value
+def remind():
+    """
+    Remind users of reminders that are due, reloading the in-memory timer from the database when needed.
+    Return the number of seconds until this should run again, so it can be used as a CheckThis function.
+    """
+    now = datetime.datetime.now()
+    if RemindMe._loaded_at is None or now >= RemindMe._loaded_at + RemindMe.reload_interval:
+        RemindMe.load_upcoming(now)
+    if due := RemindMe.pop_due(now):
+        for status in RemindMe.claim_reminders(due):
+            if RemindMe.remind_user(status):
+                REMINDERS_SENT.inc()
+    return RemindMe.seconds_until_next(datetime.datetime.now())
 
 
-def remind():
+def timezone_cache_key(argument: str) -> tuple[str, int]:
     """
-    Check the database for reminders that are due and remind the user.
+    Cache key for #timezone responses.
+    The response shows the time to the second, so it's cached per argument for the current second only.
     """
-    for status in RemindMe.list_reminders():
-        RemindMe.remind_user(status)
+    return (argument, int(time.time()))
 
 
-def timezone(status: dict):
+def timezone(status: dict | ParsedStatus):
     """
     Return the time in a timezone.
+    The timezone can be an IANA name (in any case), an IATA or ICAO airport code, or a city.
     """
-    # Get the timezone
-    # Since regex is being used anyway, no point in using utils.return_raw_argument()
-    # "^$" isn't being used, so it's fine
-    # This is looking for a string in the format "<one or more words>/<one or more words>"
-    if matches := re.search(r"(\w+\/\w+)", utils.parse_html(status["content"])):  #
-        timezone = matches.group(1)
-    else:
+    status = ParsedStatus.from_status(status)
+    if not (argument := status.argument):
         return "Seems like you didn't specify a timezone. For more information, see https://en.wikipedia.org/wiki/List_of_tz_database_time_zones"  # noqa E501
-    if timezone not in pytz.all_timezones:
-        return "Invalid timezone. For more information, see https://en.wikipedia.org/wiki/List_of_tz_database_time_zones"
+    index = timezones.get_index()
+    # The whole argument is tried first ("New York", "LHR"), then anything that looks like "<Area>/<City>" in it
+    query = argument
+    if (zone := index.lookup(query)) is None and (matches := re.search(r"(\w+(?:\/\w+)+)", argument)):
+        query = matches.group(1)
+        zone = index.lookup(query)
+    if zone is None:
+        return "Invalid timezone. Try a timezone name (https://en.wikipedia.org/wiki/List_of_tz_database_time_zones), an airport code, or a city"
 
     # Get the time
-    now = datetime.datetime.now(pytz.timezone(timezone))
-    return f"The time in {timezone} is {now.strftime('%H:%M:%S')}"
+    now = datetime.datetime.now(index.tzinfo(zone))
+    # Say which zone an airport or city was taken to mean
+    place = zone if query.casefold() == zone.casefold() else f"{query} ({zone})"
+    return f"The time in {place} is {now.strftime('%H:%M:%S')}"
 
 
-def weather(status: dict, weather_api_key: str):
+# One client for every request to the weather API, so connections are kept alive and reused
+# Created by get_http_client() the first time it's needed
+http_client = None
+_http_client_lock = threading.Lock()
+# The async client used by async commands, created by get_async_http_client() for the Trio loop it's used in
+# Every request is a task in the loop rather than a thread, so many can wait on the network at once
+async_http_client = None
+_async_http_client_token = None
+# Connections are pooled per host, and requests beyond the limit wait for a free connection
+ASYNC_HTTP_LIMITS = {"max_connections": 100, "max_keepalive_connections": 20}
+WEATHER_API_URL = "https://api.weatherapi.com/v1/current.json"
+# Weather is cached per geohash cell. Precision 5 is a cell of about 5km by 5km.
+WEATHER_GEOHASH_PRECISION = 5
+# WeatherAPI updates current conditions every 15 minutes or so
+weather_cache = TTLCache(ttl=600, maxsize=1024)
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def get_http_client() -> httpx.Client:
+    """Return the shared HTTP client, creating it if it doesn't exist yet."""
+    global http_client
+    with _http_client_lock:
+        if http_client is None:
+            import httpx
+
+            http_client = httpx.Client(timeout=10)
+        return http_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared async HTTP client, creating it if it doesn't exist yet.
+    An async client can only be used in the loop it was created in, so a new one is created if this is a different Trio loop.
+    """
+    global async_http_client, _async_http_client_token
+    token = trio.lowlevel.current_trio_token()
+    if async_http_client is None or _async_http_client_token is not token:
+        import httpx
+
+        async_http_client = httpx.AsyncClient(timeout=10, limits=httpx.Limits(**ASYNC_HTTP_LIMITS))
+        _async_http_client_token = token
+    return async_http_client
+
+
+def geohash(latitude: float, longitude: float, precision: int) -> str:
+    """
+    Return the geohash of a point, which names the cell of a grid that the point falls in.
+    https://en.wikipedia.org/wiki/Geohash
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    characters = []
+    bits = 0
+    bit_count = 0
+    # Bits alternate between longitude and latitude, starting with longitude
+    even = True
+    while len(characters) < precision:
+        value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits <<= 1
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            characters.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(characters)
+
+
+def geohash_center(cell: str) -> tuple[float, float]:
+    """Return the latitude and longitude of the center of a geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for character in cell:
+        bits = GEOHASH_ALPHABET.index(character)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            middle = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = middle
+            else:
+                value_range[1] = middle
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+async def current_weather(cell: str, weather_api_key: str) -> dict:
+    """Fetch the current weather for the center of a geohash cell from the WeatherAPI API."""
+    latitude, longitude = geohash_center(cell)
+    params = {"key": weather_api_key, "aqi": "no", "q": f"{latitude:.4f},{longitude:.4f}"}
+    response = await get_async_http_client().get(url=WEATHER_API_URL, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+async def weather(status: dict | ParsedStatus, weather_api_key: str):
     """
     Return the current weather for the location nearest to the specified coordinates.
     Uses the WeatherAPI API.
+    Results are cached for each geohash cell, and concurrent requests for the same cell share one API request.
+    This is async, so it's awaited in the Trio loop rather than holding a thread while it waits for the API.
     """
+    status = ParsedStatus.from_status(status)
 
     # Get the latitude and longitude
     # Regex for getting a float "((?:[+-]?)(?:[0-9]*)(?:[.][0-9]*)?)"
     # Again, since regex is being used anyway, no point in using utils.return_raw_argument()
     regex = r"((?:[+-]?)(?:[0-9]*)(?:[.][0-9]*)?)(?:\s*,\s*)((?:[+-]?)(?:[0-9]*)(?:[.][0-9]*)?)"  # noqa E501
-    if matches := re.search(regex, utils.parse_html(status["content"])):
+    if matches := re.search(regex, status.text):
         latitude = matches.group(1)
         longitude = matches.group(2)
     else:
@@ -162,11 +331,11 @@ def weather(status: dict, weather_api_key: str):
     if not (-180 <= float(longitude) <= 180):
         return "Invalid longitude. Please specify a longitude between -180 and 180"
 
-    # Make the request
-    params = {"key": weather_api_key, "aqi": "no", "q": f"{latitude},{longitude}"}
-    url = "https://api.weatherapi.com/v1/current.json"
-    response_dict = httpx.get(url=url, params=params).json()
-
+    # Make the request (unless the weather for this cell is cached)
+    cell = geohash(float(latitude), float(longitude), WEATHER_GEOHASH_PRECISION)
+    response_dict = await weather_cache.get_or_compute_async(
+        cell, lambda: current_weather(cell, weather_api_key)
+    )
     # Get the weather and location name (name, region, country)
     weather_c = response_dict["current"]["temp_c"]
     weather_f = response_dict["current"]["temp_f"]
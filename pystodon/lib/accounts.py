@@ -0,0 +1,129 @@
+from __future__ import annotations
+import re
+import tomllib
+from contextvars import ContextVar
+from pathlib import Path
+
+# The bot can serve several accounts from one process, each with its own stream, reminders, posts to delete, and rate limits.
+# Commands, the scheduler, and connection pools are shared between them.
+
+# The name of the account when only one is configured (with --mastodon-access-token and --mastodon-api-base-url),
+# which is also what reminders stored before accounts had names belong to
+DEFAULT_ACCOUNT = "default"
+# The name of the account handling the current mention, so commands with per-account state (such as #remindme) know whose it is.
+# Set by each account's workers and streaming thread, and inherited by the threads commands run in.
+CURRENT_ACCOUNT = ContextVar("pystodon_current_account", default=DEFAULT_ACCOUNT)
+
+# Names end up in file names, so they're kept to characters that are safe in them
+ACCOUNT_NAME = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+def account_path(path: str | None, name: str) -> str | None:
+    """Return the path for an account's file, by adding its name before the extension ("pystodon-state.json" becomes "pystodon-state-name.json")."""
+    if path is None:
+        return None
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}-{name}{path.suffix}"))
+
+
+class Account:
+    """
+    An account the bot posts as, and where its state is kept.
+    If state_path or delete_journal_path aren't set, the account doesn't save that state.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        access_token: str,
+        api_base_url: str,
+        state_path: str = None,
+        delete_journal_path: str = None,
+    ):
+        self.name = name
+        self.access_token = access_token
+        self.api_base_url = api_base_url
+        self.state_path = state_path
+        self.delete_journal_path = delete_journal_path
+
+    def __repr__(self):
+        # The access token is left out so it isn't logged
+        return f"Account({self.name!r}, {self.api_base_url!r})"
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        if not (isinstance(value, str) and ACCOUNT_NAME.fullmatch(value)):
+            raise ValueError("Account names must be letters, numbers, underscores, periods, or hyphens")
+        self._name = value
+
+    @property
+    def access_token(self):
+        return self._access_token
+
+    @access_token.setter
+    def access_token(self, value):
+        if not (isinstance(value, str) and value):
+            raise ValueError("Access token must be a non-empty string")
+        self._access_token = value
+
+    @property
+    def api_base_url(self):
+        return self._api_base_url
+
+    @api_base_url.setter
+    def api_base_url(self, value):
+        if not (isinstance(value, str) and value):
+            raise ValueError("API base URL must be a non-empty string")
+        self._api_base_url = value
+
+
+def load_accounts(
+    path: str, state_path: str = None, delete_journal_path: str = None
+) -> list[Account]:
+    """
+    Load the accounts in a TOML file, which has an [[account]] table for each one:
+
+        [[account]]
+        name = "weather"
+        access_token = "..."
+        api_base_url = "https://example.com"
+        # Optional; by default, the name is added to state_path and delete_journal_path
+        state_path = "weather-state.json"
+        delete_journal_path = "weather-posts.journal"
+
+    Each account needs its own state and journal files, so they're required to be different.
+    Raises ValueError if the file is invalid.
+    """
+    with open(path, "rb") as file:
+        tables = tomllib.load(file).get("account")
+    if not (isinstance(tables, list) and tables):
+        raise ValueError(f"{path} doesn't have any [[account]] tables")
+    accounts = []
+    for table in tables:
+        if (name := table.get("name")) is None:
+            raise ValueError(f"Every account in {path} needs a name")
+        accounts.append(
+            Account(
+                name=name,
+                access_token=table.get("access_token"),
+                api_base_url=table.get("api_base_url"),
+                state_path=table.get("state_path", account_path(state_path, name)),
+                delete_journal_path=table.get(
+                    "delete_journal_path", account_path(delete_journal_path, name)
+                ),
+            )
+        )
+    for attribute in ("name", "state_path", "delete_journal_path"):
+        values = [getattr(account, attribute) for account in accounts]
+        values = [value for value in values if value is not None]
+        if len(values) != len(set(values)):
+            raise ValueError(f"Every account in {path} needs a different {attribute}")
+    # The same credentials twice would be the same client (and Outbox), streaming twice
+    credentials = {(account.api_base_url.rstrip("/"), account.access_token) for account in accounts}
+    if len(credentials) != len(accounts):
+        raise ValueError(f"{path} has the same account more than once")
+    return accounts
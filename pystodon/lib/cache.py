@@ -0,0 +1,163 @@
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+
+import trio
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries expire ttl seconds after they're set.
+    When there are more than maxsize entries, the least recently used entry is evicted.
+
+    get_or_compute() also coalesces concurrent misses, so if several threads ask for the same missing key at once,
+    only one of them computes it and the rest wait for its result.
+    get_or_compute_async() does the same for Trio tasks, and the two can be mixed.
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        if not (ttl > 0):
+            raise ValueError("TTL must be positive")
+        if not ((maxsize > 0) and isinstance(maxsize, int)):
+            raise ValueError("Max size must be a positive integer")
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Maps keys to (time.monotonic() expiry, value), ordered from least to most recently used
+        self._entries = OrderedDict()
+        # Maps keys that are being computed to a Future for their value
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _get(self, key):
+        """Return (True, value) if the key is cached and hasn't expired, otherwise (False, None). The lock must be held."""
+        if (entry := self._entries.get(key)) is None:
+            return False, None
+        expires, value = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _set(self, key, value):
+        """Cache a value, evicting the least recently used entry if needed. The lock must be held."""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Return the cached value for a key, or default if it isn't cached."""
+        with self._lock:
+            found, value = self._get(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Cache a value for a key."""
+        with self._lock:
+            self._set(key, value)
+
+    def clear(self):
+        """Remove every entry. Values that are being computed will still be cached when they finish."""
+        with self._lock:
+            self._entries.clear()
+
+    def _claim(self, key) -> tuple[bool, object, Future | None, bool]:
+        """
+        Look a key up for get_or_compute(), returning (found, value, future, owner).
+        If it isn't cached, future is for its value, and owner is True if the caller should compute it.
+        """
+        with self._lock:
+            found, value = self._get(key)
+            if found:
+                self.hits += 1
+                return True, value, None, False
+            self.misses += 1
+            if (future := self._pending.get(key)) is not None:
+                return False, None, future, False
+            future = self._pending[key] = Future()
+            return False, None, future, True
+
+    def _resolve(self, key, future: Future, value=None, exception: BaseException = None):
+        """Finish computing a key, caching the value and passing it (or the exception) to every waiting caller."""
+        with self._lock:
+            del self._pending[key]
+            if exception is None:
+                self._set(key, value)
+        if exception is None:
+            future.set_result(value)
+        elif isinstance(exception, Exception):
+            future.set_exception(exception)
+        else:
+            # The owner was cancelled or interrupted, which isn't the waiters' problem, so one of them computes it instead
+            future.cancel()
+
+    def get_or_compute(self, key, compute: callable):
+        """
+        Return the cached value for a key, or call compute() to get it and cache the result.
+        If another thread is already computing the key, wait for its result instead.
+        Exceptions raised by compute() are passed on to every waiting caller and aren't cached.
+        """
+        while True:
+            found, value, future, owner = self._claim(key)
+            if found:
+                return value
+            if owner:
+                break
+            try:
+                return future.result()
+            except CancelledError:
+                continue
+        try:
+            value = compute()
+        except BaseException as e:
+            self._resolve(key, future, exception=e)
+            raise
+        self._resolve(key, future, value)
+        return value
+
+    async def get_or_compute_async(self, key, compute: callable):
+        """
+        The same as get_or_compute(), but for Trio tasks: compute is a coroutine function,
+        and waiting for another caller's result doesn't block the loop.
+        """
+        while True:
+            found, value, future, owner = self._claim(key)
+            if found:
+                return value
+            if owner:
+                break
+            done = trio.Event()
+            token = trio.lowlevel.current_trio_token()
+
+            def wake(_, done=done):
+                try:
+                    token.run_sync_soon(done.set)
+                except trio.RunFinishedError:
+                    pass
+
+            # Called right away if the future is already done, or from whichever thread finishes it
+            future.add_done_callback(wake)
+            await done.wait()
+            if future.cancelled():
+                continue
+            return future.result()
+        try:
+            value = await compute()
+        except BaseException as e:
+            self._resolve(key, future, exception=e)
+            raise
+        self._resolve(key, future, value)
+        return value
@@ -0,0 +1,88 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from mastodon import Mastodon
+
+from pystodon.lib.outbound import Outbox
+
+
+class MastodonClients:
+    """
+    A per-process registry of Mastodon clients, one per account.
+    Every part of the bot that talks to an account (the stream listener, reminders, commands) gets the same client,
+    so they share its keep-alive connection pool instead of each paying for new connections.
+    Clients for different accounts can share a session (and its connection pool) too, since the access token is sent with each request,
+    while each keeps its own rate limit state and Outbox.
+    """
+
+    # Clients and Outboxes are both keyed by account (its base URL and access token)
+    _clients = {}
+    _outboxes = {}
+    # Clients can be requested from worker threads
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(
+        cls,
+        access_token: str,
+        api_base_url: str,
+        pool_maxsize: int = 10,
+        session: requests.Session = None,
+    ) -> Mastodon:
+        """
+        Return the client for an account, creating it if it doesn't exist yet.
+        pool_maxsize is the number of connections kept alive, so it should be at least the number of threads posting at once.
+        If session is set, the client uses it instead of a session of its own (and pool_maxsize is ignored).
+        Both are only used when the client is created.
+        """
+        key = cls.key(api_base_url, access_token)
+        with cls._lock:
+            if (client := cls._clients.get(key)) is None:
+                client = Mastodon(
+                    access_token=access_token,
+                    api_base_url=api_base_url,
+                    session=session if session is not None else cls.pooled_session(pool_maxsize),
+                    # Rate limits are handled by the client's Outbox instead of blocking whichever thread hit them
+                    ratelimit_method="throw",
+                )
+                cls._clients[key] = client
+            return client
+
+    @classmethod
+    def outbox(cls, client: Mastodon, **kwargs) -> Outbox:
+        """
+        Return the Outbox that posts and deletes statuses with a client, creating it if it doesn't exist yet.
+        Everything posting as the same account should use the same Outbox so they share its rate limiting.
+        kwargs (such as rate and burst) are passed to the Outbox, but only when it's created.
+        """
+        key = cls.key(client.api_base_url, client.access_token)
+        with cls._lock:
+            if (outbox := cls._outboxes.get(key)) is None:
+                outbox = Outbox(client, **kwargs)
+                cls._outboxes[key] = outbox
+            return outbox
+
+    @classmethod
+    def close_all(cls):
+        """Close every client's connections and empty the registry."""
+        with cls._lock:
+            # Closing a shared session more than once is harmless
+            for client in cls._clients.values():
+                client.session.close()
+            cls._clients.clear()
+            cls._outboxes.clear()
+
+    @staticmethod
+    def key(api_base_url: str, access_token: str) -> tuple[str, str]:
+        """Return what an account's client and Outbox are registered under."""
+        return (api_base_url.rstrip("/"), access_token)
+
+    @staticmethod
+    def pooled_session(pool_maxsize: int, hosts: int = 1) -> requests.Session:
+        """Return a session that keeps up to pool_maxsize connections alive for each of up to hosts hosts."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
@@ -1,16 +1,65 @@
 # https://adamj.eu/tech/2021/05/15/python-type-hints-future-annotations/
 from __future__ import annotations
+import functools
+import heapq
+import inspect
+import itertools
+import pickle
 import re
-from datetime import datetime
-from pystodon.lib import utils
+import threading
+import time
+from collections.abc import Sequence
+from contextlib import nullcontext
+
+import trio
+from loguru import logger
+
+from pystodon.lib.cache import TTLCache
+from pystodon.lib.metrics import (
+    CHECK_ERRORS,
+    CHECK_SECONDS,
+    COMMAND_ERRORS,
+    COMMAND_SECONDS,
+    DISPATCH_SECONDS,
+    RESPONSE_CACHE,
+)
+from pystodon.lib.processes import ProcessPool
+from pystodon.lib.profiling import PROFILER
+from pystodon.lib.status import ParsedStatus
+
+# A command is a single sequence of non-whitespace characters, such as "/command"
+COMMAND_NAME_REGEX = re.compile(r"^(?:\S)+$")
+# How long help responses are cached for. They're cleared whenever a command is added or deleted, so this only bounds memory.
+HELP_CACHE_TTL = 24 * 60 * 60
+
+
+def normalize_argument(argument: str | None) -> str:
+    """Return an argument with runs of whitespace collapsed, which is what response caches are keyed on."""
+    return " ".join(argument.split()) if argument else ""
+
+
+def call_compact(function: callable, compact: tuple, args: tuple, kwargs: dict):
+    """Call a CPU-bound command's function in a pool process, with the status rebuilt from ParsedStatus.compact()."""
+    return function(ParsedStatus.from_compact(compact), *args, **kwargs)
 
 
 class CheckThis:
     """
     Every x seconds run function y.
+    Checks are scheduled on a min-heap of deadlines (time.monotonic()), so the loop only wakes up when something is due.
+    If the function returns a number, the check runs again after that many seconds instead of after the interval.
     """
 
     checks = []
+    # Entries are (deadline, sequence number, check, generation). The sequence number breaks ties so checks are never compared.
+    # Rescheduling a check bumps its generation so its older entries are skipped.
+    _schedule = []
+    _sequence = itertools.count()
+    # The schedule can be modified from Mastodon.py's streaming thread, so it's guarded by a lock
+    _lock = threading.Lock()
+    # Set by run_forever() so other threads can wake the scheduler up
+    _trio_token = None
+    _wakeup = None
 
     def __init__(self, function: callable, interval: int, *args, **kwargs):
         self.function = function
@@ -18,25 +67,122 @@ class CheckThis:
         self.function_args = args
         self.function_kwargs = kwargs
         self.last_ran = None
+        self._generation = 0
 
     def add_check(self):
         """
         Add a check to the list of checks.
+        The check is due immediately and the scheduler is woken up if it's running.
         """
-        CheckThis.checks.append(self)
+        with CheckThis._lock:
+            CheckThis.checks.append(self)
+            CheckThis._push(self, time.monotonic())
+        CheckThis._wake()
+
+    def remove_check(self):
+        """
+        Remove a check from the list of checks.
+        Its heap entry is discarded lazily when it reaches the top of the heap.
+        """
+        with CheckThis._lock:
+            CheckThis.checks.remove(self)
+        CheckThis._wake()
+
+    def run_soon(self, delay: float = 0):
+        """
+        Run the check after delay seconds, instead of whenever it was going to run next.
+        Safe to call from any thread.
+        """
+        with CheckThis._lock:
+            if self not in CheckThis.checks:
+                return
+            self._generation += 1
+            CheckThis._push(self, time.monotonic() + delay)
+        CheckThis._wake()
+
+    @classmethod
+    def _push(cls, check: CheckThis, deadline: float):
+        """Schedule a check to run at a deadline. The lock must be held."""
+        heapq.heappush(
+            cls._schedule, (deadline, next(cls._sequence), check, check._generation)
+        )
 
     @classmethod
-    def run_checks(cls):
+    def _is_stale(cls, entry: tuple) -> bool:
+        """Return True if a heap entry is for a removed check or has been replaced by rescheduling. The lock must be held."""
+        _, _, check, generation = entry
+        return check not in cls.checks or generation != check._generation
+
+    @classmethod
+    def _wake(cls):
+        """Wake up run_forever() so it recalculates how long to sleep for. Safe to call from any thread."""
+        if cls._trio_token is None:
+            return
+        try:
+            # run_sync_soon is thread-safe and can also be called from within the Trio thread
+            cls._trio_token.run_sync_soon(lambda: cls._wakeup.set())
+        except trio.RunFinishedError:
+            pass
+
+    @classmethod
+    def run_checks(cls) -> float | None:
+        """
+        Run all the checks that are due.
+        Return the number of seconds until the next check is due, or None if there are no checks.
+        """
+        while True:
+            with cls._lock:
+                # Drop entries for checks that have been removed or rescheduled
+                while cls._schedule and cls._is_stale(cls._schedule[0]):
+                    heapq.heappop(cls._schedule)
+                if not cls._schedule:
+                    return None
+                deadline, _, check, _ = cls._schedule[0]
+                now = time.monotonic()
+                if deadline > now:
+                    return deadline - now
+                heapq.heappop(cls._schedule)
+                # Anything that reschedules the check while it's running replaces the entry pushed below
+                generation = check._generation
+            label = getattr(check.function, "__name__", repr(check.function))
+            try:
+                with CHECK_SECONDS.labels(label).time(), PROFILER.section(f"check:{label}"):
+                    result = check.function(*check.function_args, **check.function_kwargs)
+            except Exception:
+                # One failing check shouldn't stop the others (or the scheduler); it's retried after its interval
+                CHECK_ERRORS.labels(label).inc()
+                logger.exception(f"Check {label} failed")
+                result = None
+            check.last_ran = time.monotonic()
+            with cls._lock:
+                if check in cls.checks and generation == check._generation:
+                    if isinstance(result, (int, float)) and not isinstance(result, bool):
+                        cls._push(check, check.last_ran + max(0, result))
+                    else:
+                        # Keep a fixed rate instead of drifting by however long the function took
+                        # If the function overran its interval, don't try to catch up on missed runs
+                        cls._push(check, max(deadline + check.interval, check.last_ran))
+
+    @classmethod
+    async def run_forever(cls):
         """
-        Run all the checks.
+        Run checks as they become due, sleeping in between.
+        Adding or removing a check wakes the loop up early.
+        Checks are run in a worker thread, so one that blocks (such as on a slow database) doesn't hold up the Trio loop.
         """
-        for check in cls.checks:
-            if (
-                check.last_ran is None
-                or (datetime.now() - check.last_ran).seconds >= check.interval
-            ):
-                check.function(*check.function_args, **check.function_kwargs)
-                check.last_ran = datetime.now()
+        cls._trio_token = trio.lowlevel.current_trio_token()
+        try:
+            while True:
+                cls._wakeup = trio.Event()
+                # Anything that wakes the scheduler while the checks run sets this event, so they're run again right after
+                delay = await trio.to_thread.run_sync(cls.run_checks)
+                if delay is None:
+                    await cls._wakeup.wait()
+                else:
+                    with trio.move_on_after(delay):
+                        await cls._wakeup.wait()
+        finally:
+            cls._trio_token = None
 
     # Setters/Getters
 
@@ -101,12 +247,37 @@ class Command:
     Intended to parse commands such as "@<bot> #<command> <arguments>".
     """
 
-    def __init__(self, command, function: callable, help_text: str, *args, **kwargs):
+    def __init__(
+        self,
+        command,
+        function: callable,
+        help_text: str,
+        *args,
+        aliases: Sequence[str] = (),
+        case_sensitive: bool = True,
+        max_concurrency: int = None,
+        profile: bool = False,
+        cpu_bound: bool = False,
+        timeout: float = None,
+        cache_ttl: float = None,
+        cache_maxsize: int = 1024,
+        cache_key: callable = None,
+        **kwargs,
+    ):
         self.command = command
         self.function = function
         self.function_args = args
         self.function_kwargs = kwargs
         self.help_text = help_text
+        self.aliases = aliases
+        self.case_sensitive = case_sensitive
+        self.max_concurrency = max_concurrency
+        self.profile = profile
+        self.cpu_bound = cpu_bound
+        self.timeout = timeout
+        self.cache_key = cache_key
+        self.cache_maxsize = cache_maxsize
+        self.cache_ttl = cache_ttl
 
     # Setters/Getters
     @property
@@ -117,11 +288,182 @@ class Command:
     @command.setter
     def command(self, command):
         """Set the command if it is a single sequence of non-whitespace characters, such as \"/command\". Otherwise, raise a ValueError."""
-        if re.search(r"^(?:\S)+$", command):
+        if COMMAND_NAME_REGEX.search(command):
             self._command = command
         else:
             raise ValueError("Command must match regex: ^(?:\\S)+$")
 
+    @property
+    def aliases(self):
+        """Get the aliases"""
+        return self._aliases
+
+    @aliases.setter
+    def aliases(self, aliases):
+        """Set the aliases. Each alias must be a valid command, such as \"/cmd\"."""
+        for alias in aliases:
+            if not COMMAND_NAME_REGEX.search(alias):
+                raise ValueError("Alias must match regex: ^(?:\\S)+$")
+        self._aliases = tuple(aliases)
+
+    @property
+    def case_sensitive(self):
+        """Get whether the command (and its aliases) are matched case-sensitively"""
+        return self._case_sensitive
+
+    @case_sensitive.setter
+    def case_sensitive(self, case_sensitive: bool):
+        """Set whether the command (and its aliases) are matched case-sensitively"""
+        self._case_sensitive = bool(case_sensitive)
+
+    @property
+    def max_concurrency(self):
+        """Get the maximum number of times this command can run at once (None means no limit)"""
+        return self._max_concurrency
+
+    @max_concurrency.setter
+    def max_concurrency(self, max_concurrency: int | None):
+        """Set the maximum number of times this command can run at once if it is None or a positive integer"""
+        if max_concurrency is None:
+            self._limiter = None
+        elif (max_concurrency > 0) and isinstance(max_concurrency, int):
+            self._limiter = trio.CapacityLimiter(max_concurrency)
+        else:
+            raise ValueError("Max concurrency must be None or a positive integer")
+        self._max_concurrency = max_concurrency
+
+    @property
+    def profile(self):
+        """Get whether this command is always profiled, even if --profile isn't set"""
+        return self._profile
+
+    @profile.setter
+    def profile(self, profile: bool):
+        """Set whether this command is always profiled, even if --profile isn't set"""
+        self._profile = bool(profile)
+
+    @property
+    def cpu_bound(self):
+        """Get whether this command's function runs in the process pool (if it's running)"""
+        return self._cpu_bound
+
+    @cpu_bound.setter
+    def cpu_bound(self, cpu_bound: bool):
+        """
+        Set whether this command's function runs in the process pool (if it's running).
+        The function has to be picklable (defined at the top level of a module, not a lambda or a nested function),
+        and it's passed a ParsedStatus with only the fields from ParsedStatus.compact().
+        Since it runs in another process, it can't change anything in the bot's process (such as adding reminders).
+        """
+        if cpu_bound:
+            if self.is_async:
+                raise ValueError("Async commands can't be CPU-bound")
+            try:
+                pickle.dumps(self.function)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                raise ValueError("CPU-bound commands must have a function that can be pickled") from None
+        self._cpu_bound = bool(cpu_bound)
+
+    @property
+    def timeout(self):
+        """Get how long (in seconds) the command can run before it's cancelled (None means no limit)"""
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, timeout: float | None):
+        """
+        Set how long (in seconds) the command can run before it's cancelled, if it is None or a positive number.
+        Async functions are cancelled at their next await. A synchronous function's thread can't be stopped,
+        so it's left to finish in the background and its result is thrown away.
+        """
+        if timeout is not None and not (
+            isinstance(timeout, (int, float)) and not isinstance(timeout, bool) and timeout > 0
+        ):
+            raise ValueError("Timeout must be None or a positive number")
+        self._timeout = timeout
+
+    @property
+    def cache_ttl(self):
+        """Get how long (in seconds) responses are cached for (None means they aren't cached)"""
+        return self._cache_ttl
+
+    @cache_ttl.setter
+    def cache_ttl(self, cache_ttl: float | None):
+        """
+        Set how long (in seconds) responses are cached for, if it is None or a positive number.
+        Only set this for commands whose response depends on nothing but the argument (and the time), without side effects.
+        Changing it empties the cache.
+        """
+        if cache_ttl is not None and not (
+            isinstance(cache_ttl, (int, float)) and not isinstance(cache_ttl, bool) and cache_ttl > 0
+        ):
+            raise ValueError("Cache TTL must be None or a positive number")
+        self._cache_ttl = cache_ttl
+        self._reset_cache()
+
+    @property
+    def cache_maxsize(self):
+        """Get the maximum number of cached responses"""
+        return self._cache_maxsize
+
+    @cache_maxsize.setter
+    def cache_maxsize(self, cache_maxsize: int):
+        """Set the maximum number of cached responses if it is a positive integer. The least recently used are evicted first. Changing it empties the cache."""
+        if not ((cache_maxsize > 0) and isinstance(cache_maxsize, int)):
+            raise ValueError("Cache max size must be a positive integer")
+        self._cache_maxsize = cache_maxsize
+        self._reset_cache()
+
+    @property
+    def cache_key(self):
+        """Get the function that turns the normalized argument into a cache key (None means the normalized argument is the key)"""
+        return self._cache_key
+
+    @cache_key.setter
+    def cache_key(self, cache_key: callable | None):
+        """
+        Set the function that turns the normalized argument (see normalize_argument()) into a cache key.
+        It can return None for arguments whose responses shouldn't be cached.
+        """
+        if cache_key is not None and not callable(cache_key):
+            raise TypeError("Cache key must be None or callable")
+        self._cache_key = cache_key
+
+    @property
+    def cache(self):
+        """Get the response cache (with hits and misses), or None if responses aren't cached (read-only)"""
+        return self._cache
+
+    def _reset_cache(self):
+        ttl = getattr(self, "_cache_ttl", None)
+        maxsize = getattr(self, "_cache_maxsize", None)
+        self._cache = TTLCache(ttl, maxsize) if ttl is not None and maxsize is not None else None
+
+    def clear_cache(self):
+        """Remove every cached response."""
+        if self._cache is not None:
+            self._cache.clear()
+
+    def cache_key_for(self, status: ParsedStatus):
+        """Return the key a status's response is cached under, or None if it isn't cached."""
+        if self._cache is None:
+            return None
+        argument = normalize_argument(status.argument)
+        return argument if self._cache_key is None else self._cache_key(argument)
+
+    @property
+    def is_async(self):
+        """Get whether the function is a coroutine function, which is awaited in the Trio loop instead of run in a thread (read-only)"""
+        function = self.function
+        while isinstance(function, functools.partial):
+            function = function.func
+        return inspect.iscoroutinefunction(function)
+
+    @property
+    def limiter(self):
+        """Get the limiter workers hold while running this command, or None if there's no limit (read-only)"""
+        return self._limiter
+
     @property
     def function(self):
         """Get the function"""
@@ -133,6 +475,7 @@ class Command:
         Set the function if it is callable.
         This function will be passed one argument, the complete status object
         This function should return a string to be posted as a reply
+        It can also be a coroutine function (async def), which is awaited in the Trio loop instead of run in a thread
         """
         if callable(function):
             self._function = function
@@ -175,37 +518,161 @@ class Command:
     def __str__(self):
         return self.command
 
+    def tokens(self):
+        """
+        Return the tokens this command is dispatched on, as (token, case_sensitive) pairs.
+        Case-insensitive tokens are casefolded.
+        """
+        for token in (self.command, *self.aliases):
+            yield (token, True) if self.case_sensitive else (token.casefold(), False)
+
+    def call(self, status: ParsedStatus):
+        """
+        Call the function with a status and return what it returns, or return the cached response if there is one.
+        Async functions are run to completion in a new Trio loop, since there's no loop to await them in.
+        """
+        if self.is_async:
+            return trio.run(self.call_async, status)
+        if (key := self.cache_key_for(status)) is None:
+            return self._call_sync(status)
+        computed = False
+
+        def compute():
+            nonlocal computed
+            computed = True
+            return self._call_sync(status)
+
+        # Concurrent misses for the same key share one call
+        content = self._cache.get_or_compute(key, compute)
+        RESPONSE_CACHE.labels(self.command, "miss" if computed else "hit").inc()
+        return content
+
+    async def call_async(self, status: ParsedStatus):
+        """
+        Call the function with a status from the Trio loop, raising trio.TooSlowError if it takes longer than the timeout.
+        Async functions are awaited directly, and synchronous functions are run in a thread.
+        Cached responses are returned without starting a thread.
+        """
+        if (key := self.cache_key_for(status)) is None:
+            return await self._call_timed(status)
+        computed = False
+
+        async def compute():
+            nonlocal computed
+            computed = True
+            return await self._call_timed(status)
+
+        content = await self._cache.get_or_compute_async(key, compute)
+        RESPONSE_CACHE.labels(self.command, "miss" if computed else "hit").inc()
+        return content
+
+    def _call_sync(self, status: ParsedStatus):
+        """Call a synchronous function, in the process pool if it's CPU-bound."""
+        with PROFILER.section(f"command:{self.command}", force=self.profile):
+            if self.cpu_bound and ProcessPool.running():
+                # Only the compact form of the status is sent, since pickling the whole status costs more than most commands
+                return ProcessPool.run(
+                    call_compact, self.function, status.compact(), self.function_args, self.function_kwargs
+                )
+            # "*" unpacks the list of arguments, while "**" unpacks the dictionary of keyword arguments
+            return self.function(status, *self.function_args, **self.function_kwargs)
+
+    async def _call_timed(self, status: ParsedStatus):
+        """Call the function from the Trio loop with the timeout applied."""
+        with trio.fail_after(self.timeout) if self.timeout is not None else nullcontext():
+            if self.is_async:
+                # Not profiled, since other tasks run on the same thread while the function is waiting
+                return await self.function(status, *self.function_args, **self.function_kwargs)
+            # cancellable lets a timeout (or shutting down) stop waiting for the thread
+            return await trio.to_thread.run_sync(self._call_sync, status, cancellable=True)
+
     # class variables
+    # _commands keeps registration order (used by help), _dispatch maps each token to its command
+    # Case-insensitive tokens are stored casefolded in a separate table so exact matches don't need to be casefolded
     _commands = []
+    _dispatch = {}
+    _dispatch_casefolded = {}
+    # Help responses for the registered commands, keyed on the normalized argument
+    _help_cache = TTLCache(ttl=HELP_CACHE_TTL, maxsize=256)
 
     # classmethods
 
     @classmethod
     def add_command(cls, command: Command):
         """
-        Add a command to the list of commands.
+        Add a command to the list of commands and index its tokens.
+        Raise a ValueError if the command, or one of its aliases, is already registered.
+        Tokens are compared case-insensitively against case-insensitive commands (in either direction),
+        since get_command would otherwise reach only one of the two.
         """
-        if isinstance(command, Command) and command not in cls._commands:
-            cls._commands.append(command)
-        else:
+        if not isinstance(command, Command):
             raise TypeError("Argument must be a Command")
+        for token, case_sensitive in command.tokens():
+            if case_sensitive:
+                taken = token in cls._dispatch or token.casefold() in cls._dispatch_casefolded
+            else:
+                # Case-insensitive tokens are already casefolded
+                taken = token in cls._dispatch_casefolded or any(
+                    registered.casefold() == token for registered in cls._dispatch
+                )
+            if taken or token == "help":
+                raise ValueError(f"{token} is already registered")
+        for token, case_sensitive in command.tokens():
+            table = cls._dispatch if case_sensitive else cls._dispatch_casefolded
+            table[token] = command
+        cls._commands.append(command)
+        cls.clear_caches(command)
 
     @classmethod
     def delete_command(cls, command: "Command"):
         """
-        Delete a command from the list of commands.
+        Delete a command from the list of commands and remove its tokens from the index.
         """
-        if isinstance(command, Command):
-            cls._commands.remove(command)
-        else:
+        if not isinstance(command, Command):
             raise TypeError("Argument must be a Command")
+        cls._commands.remove(command)
+        for token, case_sensitive in command.tokens():
+            table = cls._dispatch if case_sensitive else cls._dispatch_casefolded
+            if table.get(token) is command:
+                del table[token]
+        cls.clear_caches(command)
+
+    @classmethod
+    def clear_caches(cls, *commands: Command):
+        """
+        Remove every cached response (for help and each registered command, plus any commands passed).
+        Called whenever a command is added or deleted, since what's registered can change what a response should be.
+        """
+        cls._help_cache.clear()
+        for command in (*cls._commands, *commands):
+            command.clear_cache()
+
+    @classmethod
+    def get_command(cls, token: str, commands: list = None) -> Command | None:
+        """
+        Return the command matching a token, or None.
+        Exact matches take priority over case-insensitive matches.
+
+        If a custom list of commands is passed, it's searched linearly instead of using the index.
+        """
+        if commands is None:
+            if (command := cls._dispatch.get(token)) is not None:
+                return command
+            return cls._dispatch_casefolded.get(token.casefold())
+        folded = token.casefold()
+        for c in commands:
+            for t, case_sensitive in c.tokens():
+                if t == (token if case_sensitive else folded):
+                    return c
+        return None
 
     @staticmethod
     def parse_status(status: dict, always_mention: bool, commands: list = None):
         """
         Parse the status dict and call the appropriate command
-        It passes the status dict, as well as any args and kwargs.
-        Please note that the status dict is passed as the first argument.
+        It passes the status as a ParsedStatus, as well as any args and kwargs.
+        Please note that the status is passed as the first argument.
+        ParsedStatus behaves like the status dict, but also has the plain text, command, and argument so the HTML is only parsed once.
 
         You can provide a custom list of commands, but if you don't, it will use the class variable
         The class variable is updated with Command.add_command() and Command.delete_command()
@@ -217,57 +684,104 @@ class Command:
         If no command matches, return None.
         """
 
-        if commands is None:
-            commands = Command._commands
-
+        start = time.perf_counter()
+        status = ParsedStatus.from_status(status)
         # Get the command (the first word in the content)
-        if matches := re.search(
-            r"(?:(?:@\S+@?\S+)\s+)?(\S+)(?:\s?.*)", utils.parse_html(status["content"])
-        ):
-            command = matches.group(1)
-        else:
+        if (command := status.command) is None:
             return None
 
         #    Run the command
         if command == "help":
+            label = "help"
             content = Command.help_command(status, commands)
-            if always_mention:
-                # The Mastodon client Elk will seemingly not show the mention if it's on the first like
-                return f"@{status['account']['acct']}\n{content}"
-            else:
-                return content
+        elif (c := Command.get_command(command, commands)) is not None:
+            label = c.command
+            try:
+                with COMMAND_SECONDS.labels(label).time():
+                    content = c.call(status)
+            except Exception:
+                COMMAND_ERRORS.labels(label).inc()
+                raise
         else:
-            for c in commands:
-                if command == c.command:
-                    # "*" unpacks the list of arguments, while "**" unpacks the dictionary of keyword arguments
-                    content = c.function(
-                        status, *c.function_args, **c.function_kwargs
-                    )
-                    if always_mention:
-                        # The Mastodon client Elk will seemingly not show the mention if it's on the first like
-                        return f"@{status['account']['acct']}\n{content}"
-                    else:
-                        return content
             # Return None if no command matches
+            DISPATCH_SECONDS.labels("none").observe(time.perf_counter() - start)
+            return None
+        return Command._finish(status, content, label, start, always_mention)
+
+    @staticmethod
+    async def parse_status_async(status: dict, always_mention: bool, commands: list = None):
+        """
+        The same as parse_status(), but called from the Trio loop.
+        Async functions are awaited in the loop and synchronous ones are run in a thread,
+        so I/O-bound commands don't each need a thread while they wait.
+        If the command has a timeout and takes longer, trio.TooSlowError is raised.
+        """
+        start = time.perf_counter()
+        status = ParsedStatus.from_status(status)
+        if (command := status.command) is None:
+            return None
+
+        if command == "help":
+            label = "help"
+            content = Command.help_command(status, commands)
+        elif (c := Command.get_command(command, commands)) is not None:
+            label = c.command
+            try:
+                with COMMAND_SECONDS.labels(label).time():
+                    content = await c.call_async(status)
+            except Exception:
+                COMMAND_ERRORS.labels(label).inc()
+                raise
+        else:
+            DISPATCH_SECONDS.labels("none").observe(time.perf_counter() - start)
             return None
+        return Command._finish(status, content, label, start, always_mention)
+
+    @staticmethod
+    def _finish(status: ParsedStatus, content: str, label: str, start: float, always_mention: bool):
+        """Record how long the dispatch took and add the mention if always_mention is set."""
+        DISPATCH_SECONDS.labels(label).observe(time.perf_counter() - start)
+        if always_mention:
+            # The Mastodon client Elk will seemingly not show the mention if it's on the first like
+            return f"@{status['account']['acct']}\n{content}"
+        else:
+            return content
+
+    @classmethod
+    def metric_label(cls, token: str | None, commands: list = None) -> str:
+        """
+        Return the name a command token is recorded under in metrics: the command it invokes, "help", or "none".
+        Tokens that don't match a command all share "none" so arbitrary words can't create new metrics.
+        """
+        if token == "help":
+            return "help"
+        if token is not None and (c := cls.get_command(token, commands)) is not None:
+            return c.command
+        return "none"
 
     @staticmethod
-    def help_command(status: dict, commands: list = None) -> str:
+    def help_command(status: dict | ParsedStatus, commands: list = None) -> str:
         """
         If an argument is provided, return the help text for that command.
         Otherwise, return a list of commands.
+        Responses for the registered commands are cached until a command is added or deleted.
         """
-        if commands is None:
-            commands = Command.commands
-        if not utils.return_raw_argument(status=status):
+        argument = ParsedStatus.from_status(status).argument
+        if commands is not None:
+            return Command.help_text_for(argument, commands)
+        key = normalize_argument(argument)
+        return Command._help_cache.get_or_compute(key, lambda: Command.help_text_for(key))
+
+    @staticmethod
+    def help_text_for(argument: str | None, commands: list = None) -> str:
+        """Build the help response for an argument (see help_command())."""
+        if not argument:
             content = "Commands:\n"
-            for c in commands:
+            for c in Command._commands if commands is None else commands:
                 content += f"\n{c.command}\n"
             content += '\n\nUse "help <command>" to get help for a specific command'
             return content
         else:
-            for c in commands:
-                if utils.return_raw_argument(status=status) == c.command:
-                    content = f"Help text for {c.command}:\n{c.help_text}"
-                    return content
+            if (c := Command.get_command(argument, commands)) is not None:
+                return f"Help text for {c.command}:\n{c.help_text}"
             return "Command not found"
@@ -0,0 +1,122 @@
+from __future__ import annotations
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from loguru import logger
+
+
+class PostJournal:
+    """
+    The ids of posts the bot has made that should be deleted when it stops.
+
+    Ids are appended to an on-disk journal as they're posted ("+<id>") and deleted ("-<id>"), so they aren't kept in memory while the bot runs
+    and survive the bot crashing or being killed partway through deleting them. Whatever wasn't deleted is picked up next time.
+    The pending ids are only read back into memory when they're being deleted, until the journal is compacted (rewritten with only the pending ids),
+    which happens when it's opened and after the pending ids are deleted.
+    If path is None, the ids are kept in memory instead.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = Path(path) if path is not None else None
+        # The pending ids, oldest first, when they're in memory (always if there's no path)
+        self._pending = OrderedDict() if self.path is None else None
+        self._count = 0
+        self._file = None
+        # Posts are added from the Trio thread and worker threads
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.compact()
+            if self._count:
+                logger.info(f"{self._count} posts from an earlier run are still to be deleted")
+
+    def __len__(self):
+        """The number of posts waiting to be deleted"""
+        return self._count
+
+    def _append(self, line: str):
+        """Append a line to the journal. The lock must be held."""
+        if self._file is None:
+            # Line buffered, so each id is written out as soon as it's added
+            self._file = open(self.path, "a", buffering=1)
+        self._file.write(line + "\n")
+
+    def append(self, post_id: str):
+        """Track a post to be deleted. Named like list.append() since this replaces a list of ids."""
+        post_id = str(post_id)
+        with self._lock:
+            if self._pending is not None:
+                if post_id in self._pending:
+                    return
+                self._pending[post_id] = None
+            if self.path is not None:
+                self._append(f"+{post_id}")
+            self._count += 1
+
+    def remove(self, post_id: str):
+        """Mark a post as deleted (or as not needing to be deleted, such as when it no longer exists)."""
+        post_id = str(post_id)
+        with self._lock:
+            pending = self._loaded()
+            # Ids that aren't pending (such as ones that were already removed) don't change the journal or the count
+            if post_id not in pending:
+                return
+            del pending[post_id]
+            if self.path is not None:
+                self._append(f"-{post_id}")
+            self._count -= 1
+
+    def _loaded(self) -> OrderedDict:
+        """Return the pending ids, reading them from the journal if they aren't in memory. The lock must be held."""
+        if self._pending is None:
+            if self._file is not None:
+                self._file.flush()
+            self._pending = self._replay()
+        return self._pending
+
+    def _replay(self) -> OrderedDict:
+        """Read the journal and return the ids that were added and not removed, oldest first."""
+        pending = OrderedDict()
+        try:
+            with open(self.path) as journal:
+                for line in journal:
+                    line = line.strip()
+                    # A line cut off by a crash is missing its newline, but its id is still complete enough to try
+                    if line.startswith("+"):
+                        pending[line[1:]] = None
+                    elif line.startswith("-"):
+                        pending.pop(line[1:], None)
+        except FileNotFoundError:
+            pass
+        return pending
+
+    def pending(self) -> list[str]:
+        """Return the ids of the posts waiting to be deleted, oldest first."""
+        with self._lock:
+            return list(self._loaded())
+
+    def compact(self):
+        """Rewrite the journal with only the pending ids, replacing the file atomically."""
+        with self._lock:
+            pending = self._loaded()
+            self._count = len(pending)
+            if self.path is None:
+                return
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if pending:
+                temporary = self.path.with_name(self.path.name + ".tmp")
+                temporary.write_text("".join(f"+{post_id}\n" for post_id in pending))
+                os.replace(temporary, self.path)
+            else:
+                self.path.unlink(missing_ok=True)
+            # Until they're needed again, the ids are only kept in the journal
+            self._pending = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
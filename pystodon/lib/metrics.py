@@ -0,0 +1,346 @@
+from __future__ import annotations
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A small Prometheus client, so metrics don't need another dependency
+# https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+# Updating a metric is a dict lookup and an addition under a lock, so it's cheap enough for every mention
+
+# Latency buckets (in seconds), from a fast dispatch up to a reply stuck behind rate limiting
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """
+    A metric, with a child per combination of label values.
+    Metrics without labels are used directly (COUNTER.inc()), and metrics with labels through labels() (COUNTER.labels("x").inc()).
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: Registry = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        """Return the child for a combination of label values, creating it if it doesn't exist yet."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} has labels {self.labelnames}")
+        values = tuple(str(value) for value in values)
+        # Most lookups find an existing child, so the lock is only taken to create one
+        if (child := self._children.get(values)) is None:
+            with self._lock:
+                if (child := self._children.get(values)) is None:
+                    child = self._children[values] = self._child()
+        return child
+
+    def _child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        """The child used when the metric has no labels."""
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use labels()")
+        return self.labels()
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {escape(self.documentation)}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        if amount < 0:
+            raise ValueError("Counters can only go up")
+        with self._lock:
+            self.value += amount
+
+
+class Counter(Metric):
+    """A count of something that only goes up, such as requests or errors."""
+
+    type = "counter"
+
+    def _child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}_total{format_labels(self.labelnames, values)} {format_value(child.value)}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class GaugeChild:
+    __slots__ = ("value", "function", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set_function(self, function: callable):
+        """Read the value from function() whenever the metrics are collected, such as the length of a queue."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as how many mentions are queued."""
+
+    type = "gauge"
+
+    def _child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def set_function(self, function: callable):
+        self._default().set_function(function)
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{format_labels(self.labelnames, values)} {format_value(child.get())}"
+            for values, child in list(self._children.items())
+        ]
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # The last count is for observations above every bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe how long (in seconds) the block took, even if it raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    """How long something took (or how big something was), counted into buckets so percentiles can be calculated."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = DEFAULT_BUCKETS,
+        registry: Registry = None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+    def samples(self) -> list[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            with child._lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, values)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics that are exposed together."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"A metric named {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Return every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry at /metrics."""
+
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        data = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Prometheus scrapes every few seconds, which isn't worth logging
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the metrics over HTTP on a background thread. Returns the server so it can be shut down."""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
+
+
+# The bot's metrics
+MENTIONS = Counter(
+    "pystodon_mentions",
+    "Mentions handled, by command and result (replied, no_reply, too_long, timeout, or error)",
+    ("command", "result"),
+)
+DISPATCH_SECONDS = Histogram(
+    "pystodon_dispatch_seconds",
+    "Time to parse a mention and run its command, by command",
+    ("command",),
+)
+COMMAND_SECONDS = Histogram(
+    "pystodon_command_seconds",
+    "Time spent in each command's function",
+    ("command",),
+)
+RESPONSE_CACHE = Counter(
+    "pystodon_response_cache",
+    "Responses looked up in each command's response cache, by result (hit or miss)",
+    ("command", "result"),
+)
+COMMAND_ERRORS = Counter(
+    "pystodon_command_errors",
+    "Exceptions raised by each command's function",
+    ("command",),
+)
+REPLY_SECONDS = Histogram(
+    "pystodon_reply_seconds",
+    "Time from a mention being received to the reply being posted, by command",
+    ("command",),
+)
+QUEUE_DEPTH = Gauge("pystodon_queue_depth", "Mentions waiting for a worker, by account", ("account",))
+QUEUE_REJECTED = Counter(
+    "pystodon_queue_rejected",
+    "Mentions dropped or answered with a busy message because the queue was full, by policy",
+    ("policy",),
+)
+OUTBOUND_SECONDS = Histogram(
+    "pystodon_outbound_seconds",
+    "Time taken by each call to the Mastodon API made through the Outbox, such as status_post",
+    ("method",),
+)
+OUTBOUND_REQUESTS = Counter(
+    "pystodon_outbound_requests",
+    "Calls to the Mastodon API made through the Outbox, by method and result (ok, retried, failed, or not_found)",
+    ("method", "result"),
+)
+OUTBOX_DEPTH = Gauge(
+    "pystodon_outbox_depth", "Requests queued or in flight in the Outbox, by account", ("account",)
+)
+POSTS_TO_DELETE = Gauge(
+    "pystodon_posts_to_delete", "Posts waiting to be deleted when the bot stops, by account", ("account",)
+)
+CHECK_SECONDS = Histogram(
+    "pystodon_check_seconds",
+    "Time taken by each scheduled check",
+    ("check",),
+)
+CHECK_ERRORS = Counter(
+    "pystodon_check_errors",
+    "Exceptions raised by each scheduled check",
+    ("check",),
+)
+STORAGE_SECONDS = Histogram(
+    "pystodon_reminder_storage_seconds",
+    "Time taken by reminder storage operations (add, upcoming, and claim)",
+    ("operation",),
+)
+REMINDERS_SENT = Counter("pystodon_reminders_sent", "Reminders claimed and queued to be sent")
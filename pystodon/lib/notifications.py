@@ -0,0 +1,111 @@
+from __future__ import annotations
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from loguru import logger
+
+# How many of the most recently handled ids are saved, so notifications that are fetched again after a restart aren't answered twice
+SAVED_RECENT_IDS = 1000
+
+
+def notification_id_key(notification_id: str) -> tuple[int, str]:
+    """
+    Sort key for notification ids.
+    Mastodon's ids are numeric strings, so a longer id is a later one. Comparing the length first also works for
+    fixed-length ids, such as the flake ids some other servers use.
+    """
+    notification_id = str(notification_id)
+    return (len(notification_id), notification_id)
+
+
+class NotificationTracker:
+    """
+    Keeps track of which mention notifications have been handled, so none are answered twice
+    and the ones missed while the stream was down can be fetched when it reconnects.
+
+    Claimed ids are kept in a bounded LRU set (the most recent maxsize ids), and cursor is the highest id claimed so far.
+    Ids that were claimed but not finished are kept too, so if the bot stops before handling them they can be fetched again.
+    If a path is given, the cursor, the unfinished ids, and the most recent ids are saved there and loaded on startup.
+    """
+
+    def __init__(self, path: str | None = None, maxsize: int = 10000):
+        if not ((maxsize > 0) and isinstance(maxsize, int)):
+            raise ValueError("Max size must be a positive integer")
+        self.path = Path(path) if path is not None else None
+        self.maxsize = maxsize
+        self.cursor = None
+        # Ids that were unfinished when the state was saved, to be fetched again on startup
+        self.recovered = []
+        self._seen = OrderedDict()
+        self._unfinished = set()
+        self._dirty = False
+        # Claimed from the streaming thread and marked as done from the Trio thread
+        self._lock = threading.Lock()
+        self.load()
+
+    def __contains__(self, notification_id: str) -> bool:
+        with self._lock:
+            return str(notification_id) in self._seen
+
+    def _remember(self, notification_id: str):
+        """Add an id to the LRU set. The lock must be held."""
+        self._seen[notification_id] = None
+        self._seen.move_to_end(notification_id)
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+
+    def claim(self, notification_id: str) -> bool:
+        """Mark a notification as being handled. Return False if it was already claimed, so it shouldn't be handled again."""
+        notification_id = str(notification_id)
+        with self._lock:
+            if notification_id in self._seen:
+                return False
+            self._remember(notification_id)
+            self._unfinished.add(notification_id)
+            if self.cursor is None or notification_id_key(notification_id) > notification_id_key(self.cursor):
+                self.cursor = notification_id
+            self._dirty = True
+            return True
+
+    def done(self, notification_id: str):
+        """Mark a claimed notification as handled (or deliberately not handled, such as when it's dropped)."""
+        with self._lock:
+            self._unfinished.discard(str(notification_id))
+            self._dirty = True
+
+    def load(self):
+        """Load the state saved by save(), if there is any."""
+        if self.path is None or not self.path.is_file():
+            return
+        try:
+            state = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            logger.exception(f"Couldn't read {self.path}; missed mentions won't be fetched")
+            return
+        with self._lock:
+            self.cursor = state.get("last_id")
+            self.recovered = [str(i) for i in state.get("unfinished", [])]
+            for notification_id in state.get("recent", []):
+                self._remember(str(notification_id))
+
+    def save(self):
+        """Save the state (if it's changed since the last save) to the path, replacing the file atomically."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            recent = list(self._seen)[-SAVED_RECENT_IDS:]
+            state = {
+                "last_id": self.cursor,
+                # Ids recovered at startup stay unfinished until they've been fetched and handled
+                "unfinished": sorted(self._unfinished | set(self.recovered), key=notification_id_key),
+                "recent": [i for i in recent if i not in self._unfinished],
+            }
+            self._dirty = False
+        temporary = self.path.with_name(self.path.name + ".tmp")
+        temporary.write_text(json.dumps(state))
+        os.replace(temporary, self.path)
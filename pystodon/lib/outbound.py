@@ -0,0 +1,285 @@
+from __future__ import annotations
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import trio
+from loguru import logger
+from mastodon import (
+    Mastodon,
+    MastodonNetworkError,
+    MastodonNotFoundError,
+    MastodonRatelimitError,
+    MastodonServerError,
+)
+
+from pystodon.lib.metrics import OUTBOUND_REQUESTS, OUTBOUND_SECONDS
+
+# Lower numbers are sent first
+# Replies (command results and reminders) go ahead of bulk work like deleting posts on shutdown
+PRIORITY_REPLY = 0
+PRIORITY_BULK = 10
+
+# Errors that are worth retrying
+TRANSIENT_ERRORS = (MastodonNetworkError, MastodonServerError, MastodonRatelimitError)
+
+
+class TokenBucket:
+    """
+    Allow up to burst requests at once, refilling at rate requests per second.
+    Uses time.monotonic(), so it isn't affected by the system clock changing.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        if not (rate > 0 and burst > 0):
+            raise ValueError("Rate and burst must be positive")
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Take a token and return how long to wait (in seconds) before using it."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class OutboundRequest:
+    """A queued call to a Mastodon client method, such as status_post or status_delete."""
+
+    def __init__(
+        self, method: str, args: tuple, kwargs: dict, priority: int, callback: callable, errback: callable = None
+    ):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.callback = callback
+        self.errback = errback
+        self.attempts = 0
+        # Its place in the queue among requests with the same priority, set when it's taken to be sent
+        self.sequence = None
+
+    def __str__(self):
+        return f"{self.method}{self.args}"
+
+
+class Outbox:
+    """
+    Outbound requests (posting and deleting statuses) for one client, sent in priority order.
+    Requests are paced with a token bucket and by the X-RateLimit-* headers Mastodon sends back
+    (which Mastodon.py stores as ratelimit_remaining and ratelimit_reset).
+    Transient failures are retried with exponential backoff and full jitter.
+
+    submit() can be called from any thread. Requests are sent once run() (or drain()) is running in a Trio loop.
+    """
+
+    def __init__(
+        self,
+        mastodon: Mastodon,
+        rate: float = 1.0,
+        burst: int = 30,
+        concurrency: int = 4,
+        max_attempts: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ):
+        if not ((concurrency > 0) and isinstance(concurrency, int)):
+            raise ValueError("Concurrency must be a positive integer")
+        self.mastodon = mastodon
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Entries are (priority, sequence number, request) for requests that can be sent now,
+        # and (time.monotonic() deadline, sequence number, request) for requests waiting to be retried
+        self._ready = []
+        self._delayed = []
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        # Requests are submitted from worker threads, so the queues are guarded by a lock
+        self._lock = threading.Lock()
+        self._trio_token = None
+        # Senders with nothing to send park here until a request is submitted or finished
+        self._idle = trio.lowlevel.ParkingLot()
+        # Set (to a time.monotonic() value) when the rate limit has been used up
+        self._paused_until = 0.0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ready) + len(self._delayed) + self._in_flight
+
+    def submit(
+        self,
+        method: str,
+        *args,
+        priority: int = PRIORITY_REPLY,
+        callback: callable = None,
+        errback: callable = None,
+        **kwargs,
+    ):
+        """
+        Queue a call to a client method, such as submit("status_post", "Hello", visibility="public").
+        callback is called with the result once the call succeeds, and errback with the exception if it's given up on.
+        """
+        request = OutboundRequest(method, args, kwargs, priority, callback, errback)
+        with self._lock:
+            heapq.heappush(self._ready, (priority, next(self._sequence), request))
+        self._wake()
+
+    def _wake(self):
+        """Wake up any senders waiting for requests. Safe to call from any thread."""
+        if self._trio_token is None:
+            return
+        try:
+            self._trio_token.run_sync_soon(self._idle.unpark_all)
+        except trio.RunFinishedError:
+            pass
+
+    def _next(self) -> tuple[OutboundRequest | None, float | None]:
+        """
+        Return the next request that can be sent, or None and how long until a delayed request is ready (None if there aren't any).
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, sequence, request = heapq.heappop(self._delayed)
+                heapq.heappush(self._ready, (request.priority, sequence, request))
+            if self._ready:
+                self._in_flight += 1
+                _, sequence, request = heapq.heappop(self._ready)
+                request.sequence = sequence
+                return request, None
+            if self._delayed:
+                return None, self._delayed[0][0] - now
+            return None, None
+
+    def _requeue(self, request: OutboundRequest):
+        """Put a request that was taken by _next() but not sent back in the queue, in its original place."""
+        with self._lock:
+            heapq.heappush(self._ready, (request.priority, request.sequence, request))
+
+    def _retry_later(self, request: OutboundRequest, delay: float):
+        """Put a request back in the queue to be sent after a delay."""
+        with self._lock:
+            heapq.heappush(
+                self._delayed, (time.monotonic() + delay, next(self._sequence), request)
+            )
+
+    def _backoff(self, attempts: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempts))
+
+    def _rate_limit_delay(self) -> float:
+        """
+        Return how long to wait before the next request, based on the token bucket and the last rate limit headers.
+        If only a few requests are left in the current window, they're spread out until it resets.
+        """
+        delay = self.bucket.delay()
+        now = time.monotonic()
+        if self._paused_until > now:
+            delay = max(delay, self._paused_until - now)
+        remaining = getattr(self.mastodon, "ratelimit_remaining", None)
+        reset = getattr(self.mastodon, "ratelimit_reset", None)
+        if remaining is not None and reset is not None:
+            # ratelimit_reset is a Unix timestamp that Mastodon.py has already adjusted to the local clock
+            until_reset = max(0.0, reset - time.time())
+            if remaining <= 0:
+                delay = max(delay, until_reset)
+            elif remaining < self.bucket.burst:
+                delay = max(delay, until_reset / remaining)
+        return delay
+
+    async def _send(self, request: OutboundRequest):
+        """Send a request, retrying or dropping it if it fails."""
+        request.attempts += 1
+        try:
+            with OUTBOUND_SECONDS.labels(request.method).time():
+                result = await trio.to_thread.run_sync(
+                    lambda: getattr(self.mastodon, request.method)(
+                        *request.args, **request.kwargs
+                    )
+                )
+        except MastodonNotFoundError as e:
+            # Usually a reply to (or deletion of) a status that has since been deleted
+            OUTBOUND_REQUESTS.labels(request.method, "not_found").inc()
+            logger.warning(f"{request} failed since the status no longer exists")
+            self._give_up(request, e)
+        except TRANSIENT_ERRORS as e:
+            if request.attempts >= self.max_attempts:
+                OUTBOUND_REQUESTS.labels(request.method, "failed").inc()
+                logger.error(f"{request} failed {request.attempts} times; giving up: {e}")
+                self._give_up(request, e)
+                return
+            OUTBOUND_REQUESTS.labels(request.method, "retried").inc()
+            delay = self._backoff(request.attempts)
+            if isinstance(e, MastodonRatelimitError):
+                # Don't send anything else until the rate limit resets
+                reset = getattr(self.mastodon, "ratelimit_reset", None)
+                if reset is not None:
+                    delay = max(delay, reset - time.time())
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            logger.warning(f"{request} failed ({e}); retrying in {delay:.1f}s")
+            self._retry_later(request, delay)
+        except Exception as e:
+            OUTBOUND_REQUESTS.labels(request.method, "failed").inc()
+            logger.exception(f"{request} failed")
+            self._give_up(request, e)
+        else:
+            OUTBOUND_REQUESTS.labels(request.method, "ok").inc()
+            if request.callback is not None:
+                request.callback(result)
+
+    @staticmethod
+    def _give_up(request: OutboundRequest, exception: Exception):
+        if request.errback is not None:
+            request.errback(exception)
+
+    async def _sender(self, stop_when_empty: bool):
+        """Send requests as they become available."""
+        while True:
+            request, wait = self._next()
+            if request is None:
+                if stop_when_empty and len(self) == 0:
+                    # Let the other senders notice the queue is empty too
+                    self._idle.unpark_all()
+                    return
+                with trio.move_on_after(wait if wait is not None else float("inf")):
+                    await self._idle.park()
+                continue
+            try:
+                try:
+                    await trio.sleep(self._rate_limit_delay())
+                except trio.Cancelled:
+                    # It hasn't been sent, so it goes back in the queue for whoever sends next (such as drain() on shutdown)
+                    self._requeue(request)
+                    raise
+                await self._send(request)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                # A retry may have been queued, or the queue may now be empty
+                self._idle.unpark_all()
+
+    async def run(self, stop_when_empty: bool = False, concurrency: int = None):
+        """
+        Send requests with up to concurrency requests at once (the Outbox's concurrency if it isn't given).
+        Runs forever unless stop_when_empty is set.
+        """
+        self._trio_token = trio.lowlevel.current_trio_token()
+        try:
+            async with trio.open_nursery() as nursery:
+                for _ in range(concurrency if concurrency is not None else self.concurrency):
+                    nursery.start_soon(self._sender, stop_when_empty)
+        finally:
+            self._trio_token = None
+
+    async def drain(self, concurrency: int = None):
+        """Send everything that's queued (including retries), then return."""
+        await self.run(stop_when_empty=True, concurrency=concurrency)
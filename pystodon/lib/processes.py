@@ -0,0 +1,89 @@
+from __future__ import annotations
+import multiprocessing
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+# Modules imported by each process when it starts, so the first task sent to it doesn't pay for the import
+WARM_IMPORTS = ("bs4", "dateparser", "pystodon.commands")
+
+
+def initialize_process():
+    """Run in each process of the pool when it starts."""
+    # Ctrl+C is sent to every process in the group; the bot shuts the pool down itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for module in WARM_IMPORTS:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+
+def ready() -> bool:
+    return True
+
+
+class ProcessPool:
+    """
+    A per-process pool of worker processes for CPU-bound work (commands marked cpu_bound, BeautifulSoup, and dateparser).
+    With the GIL, threads can only use one core, so CPU-bound work is sent to other processes instead.
+    If the pool isn't running (the default), run() calls the function in the current process.
+
+    Functions and their arguments are pickled, so functions must be defined at the top level of a module
+    and arguments should be small (such as the compact form of a status, see ParsedStatus.compact()).
+    """
+
+    _executor = None
+    _processes = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def start(cls, processes: int):
+        """Start the pool and wait until every process is ready, so the first burst of work doesn't wait for them to start."""
+        if not ((processes > 0) and isinstance(processes, int)):
+            raise ValueError("Processes must be a positive integer")
+        # Forking a process that's already running threads can deadlock, so a fork server is used where it's available
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with cls._lock:
+            if cls._executor is not None:
+                return
+            cls._executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context(method),
+                initializer=initialize_process,
+            )
+            cls._processes = processes
+            # Processes are started as tasks are submitted, so submit one per process
+            for future in [cls._executor.submit(ready) for _ in range(processes)]:
+                future.result()
+        logger.info(f"Started {processes} processes for CPU-bound work")
+
+    @classmethod
+    def shutdown(cls):
+        """Stop the pool, waiting for tasks that are running to finish."""
+        with cls._lock:
+            executor, cls._executor = cls._executor, None
+            cls._processes = 0
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @classmethod
+    def running(cls) -> bool:
+        return cls._executor is not None
+
+    @classmethod
+    def capacity(cls) -> int:
+        """How many calls to run() can make progress at once: the number of processes, or 1 if the pool isn't running."""
+        return max(1, cls._processes)
+
+    @classmethod
+    def run(cls, function: callable, *args):
+        """
+        Call function(*args) in the pool and return the result, blocking until it's done.
+        Exceptions raised by the function are raised here. Safe to call from any thread.
+        """
+        if (executor := cls._executor) is None:
+            return function(*args)
+        return executor.submit(function, *args).result()
@@ -0,0 +1,170 @@
+from __future__ import annotations
+import atexit
+import datetime
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from loguru import logger
+
+# A sampling profiler for command handlers, HTML parsing, and scheduled checks.
+# Code to be profiled runs inside a section (PROFILER.section("label")), and a background thread
+# periodically samples the stacks of threads that are inside one. Samples are aggregated into the collapsed-stack
+# ("folded") format that flamegraph.pl, inferno, and speedscope read: one line per stack, "label;frame;frame count".
+# Since the cost is a fixed number of samples per second rather than a hook on every function call, it can stay on in production.
+
+
+class Section:
+    """Marks a thread as being inside a profiled section while the with block runs."""
+
+    __slots__ = ("profiler", "label", "thread_id")
+
+    def __init__(self, profiler: Profiler, label: str):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        # The frame running the with statement is the root of this section's stacks
+        self.profiler._enter(self.thread_id, self.label, sys._getframe(1))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._exit(self.thread_id)
+        return False
+
+
+class Profiler:
+    """
+    Samples threads that are inside a section every sample_interval seconds,
+    and writes the aggregated stacks to a new file in directory every flush_interval seconds.
+    At most max_stacks distinct stacks are kept per file (the rest are counted as "[other]"), and stacks are cut off at max_depth frames,
+    so memory and file sizes stay bounded.
+
+    Sections are only profiled if profile_all is set or they're entered with force=True (such as for a command with profile=True).
+    The sampling thread is started by start(), or by the first profiled section.
+    """
+
+    def __init__(
+        self,
+        directory: str = "profiles",
+        sample_interval: float = 0.01,
+        flush_interval: float = 60,
+        max_stacks: int = 5000,
+        max_depth: int = 64,
+    ):
+        self.directory = directory
+        self.sample_interval = sample_interval
+        self.flush_interval = flush_interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.profile_all = False
+        self.samples = 0
+        # Maps thread ids to the (label, root frame) of each section they're in, outermost first
+        self._active = {}
+        # Maps collapsed stacks to how many times they were sampled since the last flush
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def section(self, label: str, force: bool = False):
+        """Return a context manager that profiles its block, or does nothing if this section isn't being profiled."""
+        if not (self.profile_all or force):
+            return nullcontext()
+        if self._thread is None:
+            self.start()
+        return Section(self, label.replace(";", ":").replace(" ", "_"))
+
+    def _enter(self, thread_id: int, label: str, frame):
+        with self._lock:
+            self._active.setdefault(thread_id, []).append((label, frame))
+
+    def _exit(self, thread_id: int):
+        with self._lock:
+            sections = self._active[thread_id]
+            sections.pop()
+            if not sections:
+                del self._active[thread_id]
+
+    def start(self):
+        """Start sampling on a background thread. Safe to call more than once."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name="profiler")
+            self._thread.start()
+        # Write out whatever was sampled since the last flush when the bot exits
+        atexit.register(self.stop)
+        logger.info(f"Profiling; writing collapsed stacks to {self.directory} every {self.flush_interval}s")
+
+    def stop(self):
+        """Stop sampling and write any samples that haven't been written yet."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stopped.set()
+        thread.join()
+        self.flush()
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stopped.wait(self.sample_interval):
+            self.sample()
+            if time.monotonic() >= next_flush:
+                next_flush += self.flush_interval
+                self.flush()
+
+    @staticmethod
+    def frame_name(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self):
+        """Record the stack of every thread that's inside a section."""
+        with self._lock:
+            if not self._active:
+                return
+            active = {thread_id: list(sections) for thread_id, sections in self._active.items()}
+        frames = sys._current_frames()
+        stacks = []
+        for thread_id, sections in active.items():
+            if (frame := frames.get(thread_id)) is None:
+                continue
+            root = sections[0][1]
+            names = []
+            # Walk from the innermost frame up to the frame that entered the outermost section
+            while frame is not None and frame is not root and len(names) < self.max_depth:
+                names.append(self.frame_name(frame))
+                frame = frame.f_back
+            names.append(self.frame_name(root))
+            names.reverse()
+            stacks.append(";".join([label for label, _ in sections] + names))
+        with self._lock:
+            self.samples += len(stacks)
+            for stack in stacks:
+                if stack not in self._counts and len(self._counts) >= self.max_stacks:
+                    stack = f"{stack.split(';', 1)[0]};[other]"
+                self._counts[stack] = self._counts.get(stack, 0) + 1
+
+    def flush(self) -> Path | None:
+        """Write the stacks sampled since the last flush to a new file and return its path (None if nothing was sampled)."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return None
+        directory = Path(self.directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"pystodon-{datetime.datetime.now():%Y%m%d-%H%M%S-%f}.folded"
+        path.write_text(
+            "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+        )
+        return path
+
+
+PROFILER = Profiler()
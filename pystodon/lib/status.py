@@ -0,0 +1,176 @@
+from __future__ import annotations
+import html
+import re
+from collections.abc import Mapping
+
+import trio
+from pystodon.lib.processes import ProcessPool
+from pystodon.lib.profiling import PROFILER
+
+# Compiled once at import time since these run for every mention
+# The command is the first word in the content, optionally preceded by a mention
+COMMAND_TOKEN_REGEX = re.compile(r"(?:(?:@\S+@?\S+)\s+)?(\S+)(?:\s?.*)")
+# Match the optional mention and the command, capturing everything after the command
+# From what I can tell, there w1ill always be a mention, even if it's a reply. Some clients just don't show it in the body content. Either way, making it optional shouldn't have any negative effects.
+# re.DOTALL is present so commands can span multiple lines
+RAW_ARGUMENT_REGEX = re.compile(
+    r"^(?:(?:@\S+@?\S+)\s+)?(?:\S+)(?:\s?(.*))$", flags=re.IGNORECASE | re.DOTALL
+)
+
+# A start or end tag. Quoted attribute values are matched separately so a ">" inside of one doesn't end the tag.
+TAG_REGEX = re.compile(r"""<(/?)([a-zA-Z][a-zA-Z0-9]*)((?:[^<>"']|"[^"]*"|'[^']*')*)>""")
+# The tags Mastodon uses in status content
+# https://docs.joinmastodon.org/spec/activitypub/#sanitization
+SIMPLE_TAGS = frozenset({"p", "br", "a", "span"})
+# Limits how many statuses ParsedStatus.parse_async() parses with BeautifulSoup at once, to as many as can actually run in parallel.
+# More threads than that wouldn't be any faster, and would leave the Trio thread waiting for the GIL.
+_soup_limiter = trio.CapacityLimiter(1)
+
+
+def html_to_text(html_content: str) -> str:
+    """
+    Return the raw post content, with newlines after every <p> tag and for every <br> tag.
+    Mastodon's markup is simple enough to be handled with a regex.
+    If anything else shows up (other tags, comments, unbalanced paragraphs), BeautifulSoup is used instead,
+    in the process pool if it's running.
+    The regex is faster than sending the content to another process, so it always runs in this one.
+    """
+    text = simple_html_to_text(html_content)
+    return text if text is not None else ProcessPool.run(html_to_text_soup, html_content)
+
+
+def simple_html_to_text(html_content: str) -> str | None:
+    """The regex part of html_to_text(), which returns None if the markup needs BeautifulSoup."""
+    parts = []
+    position = 0
+    open_paragraphs = 0
+    for match in TAG_REGEX.finditer(html_content):
+        parts.append(html_content[position : match.start()])
+        position = match.end()
+        closing, tag = match.group(1), match.group(2).lower()
+        if tag not in SIMPLE_TAGS:
+            return None
+        if tag == "br":
+            parts.append("\n")
+        elif tag == "p":
+            if closing:
+                open_paragraphs -= 1
+                parts.append("\n")
+            else:
+                open_paragraphs += 1
+    parts.append(html_content[position:])
+    text = "".join(parts)
+    # Mastodon escapes "<" in text, so one being left over means the markup wasn't understood
+    if open_paragraphs != 0 or "<" in text:
+        return None
+    return html.unescape(text)
+
+
+def html_to_text_soup(html_content: str) -> str:
+    """The same as html_to_text(), but using BeautifulSoup to handle arbitrary HTML"""
+    # Only imported if it's needed
+    from bs4 import BeautifulSoup
+
+    content = BeautifulSoup(html_content, "html.parser")
+    for p in content.find_all("p"):
+        p.insert_after("\n")
+        # Perhaps don't insert a newline if it's the last <p> tag?
+    for br in content.find_all("br"):
+        br.replace_with("\n")
+    return content.get_text(separator="")
+
+
+class ParsedStatus(Mapping):
+    """
+    A status that has had its content parsed once, so commands don't have to parse the HTML again.
+    It behaves like the status dict it wraps (status["account"]["acct"] and status.account both work).
+
+    text is the plain text content, command is the first word (after the mention), and argument is everything after the command.
+    command and argument are None if the content is empty.
+    """
+
+    __slots__ = ("status", "text", "command", "argument")
+
+    def __init__(self, status: dict, text: str = None):
+        """Parse a status. If its plain text content has already been worked out, it can be passed as text."""
+        self.status = status
+        if text is None:
+            with PROFILER.section("html_to_text"):
+                text = html_to_text(status["content"])
+        self.text = text
+        if matches := COMMAND_TOKEN_REGEX.search(self.text):
+            self.command = matches.group(1)
+        else:
+            self.command = None
+        if matches := RAW_ARGUMENT_REGEX.search(self.text):
+            self.argument = matches.group(1).rstrip()
+        else:
+            # Unsure if it should return None or an empty string
+            self.argument = None
+
+    def compact(self) -> tuple:
+        """
+        Return the parts of the status that commands usually need, as a tuple that's cheap to send to another process.
+        The full status can be dozens of fields (the account, media, emojis...), most of which commands never look at.
+        """
+        return (
+            self.status["id"],
+            self.status.get("visibility"),
+            self.status["account"]["acct"],
+            self.text,
+            self.command,
+            self.argument,
+        )
+
+    @classmethod
+    def from_compact(cls, compact: tuple) -> ParsedStatus:
+        """
+        Rebuild a ParsedStatus from compact(), without parsing the content again.
+        The status it wraps only has id, visibility, and account.acct.
+        """
+        status_id, visibility, acct, text, command, argument = compact
+        parsed = cls.__new__(cls)
+        parsed.status = {"id": status_id, "visibility": visibility, "account": {"acct": acct}}
+        parsed.text = text
+        parsed.command = command
+        parsed.argument = argument
+        return parsed
+
+    @classmethod
+    async def parse_async(cls, status: dict) -> ParsedStatus:
+        """
+        The same as ParsedStatus(status), but for the Trio loop.
+        Content that needs BeautifulSoup is parsed in a worker thread (which waits on the process pool if it's running),
+        so the loop isn't blocked and several can be parsed at once. Everything else is parsed right away.
+        """
+        with PROFILER.section("html_to_text"):
+            text = simple_html_to_text(status["content"])
+        if text is None:
+            _soup_limiter.total_tokens = ProcessPool.capacity()
+            text = await trio.to_thread.run_sync(
+                ProcessPool.run, html_to_text_soup, status["content"], limiter=_soup_limiter
+            )
+        return cls(status, text)
+
+    @classmethod
+    def from_status(cls, status: dict | ParsedStatus) -> ParsedStatus:
+        """Return the status if it's already been parsed, otherwise parse it."""
+        return status if isinstance(status, cls) else cls(status)
+
+    def __getitem__(self, key):
+        return self.status[key]
+
+    def __iter__(self):
+        return iter(self.status)
+
+    def __len__(self):
+        return len(self.status)
+
+    def __getattr__(self, name):
+        # Only called for names that aren't slots, so this forwards attribute access to the status
+        if name in ParsedStatus.__slots__:
+            raise AttributeError(name)
+        try:
+            return self.status[name]
+        except KeyError:
+            raise AttributeError(name) from None
@@ -0,0 +1,231 @@
+from __future__ import annotations
+import datetime
+import json
+from collections.abc import Collection
+
+# https://docs.peewee-orm.com/en/latest/peewee/quickstart.html
+# https://docs.peewee-orm.com/en/latest/peewee/models.html#field-types-table
+import peewee
+from playhouse.pool import PooledPostgresqlDatabase, PooledSqliteDatabase
+
+from pystodon.lib.accounts import DEFAULT_ACCOUNT
+from pystodon.lib.metrics import STORAGE_SECONDS
+
+# https://stackoverflow.com/a/45043715
+# https://timlehr.com/2018/01/lazy-database-initialization-with-peewee-proxy-subclasses/
+peewee_proxy = peewee.Proxy()
+
+
+class RelativeReminder(peewee.Model):
+    """
+    A class to represent a reminder that stores what's needed to reply to a status and when to reply
+    """
+
+    status_id = peewee.CharField()
+    acct = peewee.CharField()
+    visibility = peewee.CharField()
+    datetime = peewee.DateTimeField()
+    # The name of the bot account the reminder was set with, which is the account that posts it
+    account = peewee.CharField(default=DEFAULT_ACCOUNT)
+
+    class Meta:
+        database = peewee_proxy
+        table_name = "reminder"
+
+
+# Upcoming reminders are found with a range query on datetime for the accounts a process serves
+RelativeReminder.add_index(
+    RelativeReminder.account, RelativeReminder.datetime, name="reminder_account_datetime"
+)
+
+
+class LegacyRelativeReminder(peewee.Model):
+    """
+    Reminders from before only the needed fields were stored, which stored the entire status dict as JSON.
+    Only used to move old reminders into the new table.
+    """
+
+    status = peewee.TextField()
+    datetime = peewee.DateTimeField()
+
+    class Meta:
+        database = peewee_proxy
+        table_name = "relativereminder"
+
+
+class ReminderStorage:
+    """
+    Where reminders are stored.
+    Subclasses choose the database; creating one points the reminder models at it.
+    Every method gets a connection from the database's pool for as long as it needs it.
+    Methods that find or claim reminders only touch those of the bot accounts in accounts,
+    so a process never claims reminders for accounts it isn't serving (such as another process's, when the database is shared).
+    """
+
+    # How many reminders to claim per query
+    batch_size = 100
+
+    def __init__(self, database: peewee.Database):
+        self.database = database
+        peewee_proxy.initialize(database)
+
+    def setup(self):
+        """
+        Create the reminder table (and its index) and move any reminders from the legacy table into it.
+        Tables from before reminders had an account get the column, with existing reminders belonging to DEFAULT_ACCOUNT,
+        and their index on datetime alone is replaced.
+        Run once at startup, before any reminders are added or checked.
+        """
+        table = RelativeReminder._meta.table_name
+        with self.database.connection_context():
+            if RelativeReminder.table_exists():
+                from playhouse.migrate import SchemaMigrator, migrate
+
+                migrator = SchemaMigrator.from_database(self.database)
+                columns = {column.name for column in self.database.get_columns(table)}
+                indexes = {index.name for index in self.database.get_indexes(table)}
+                with self.database.atomic():
+                    # The column has to exist before the index on it is created below
+                    if "account" not in columns:
+                        migrate(migrator.add_column(table, "account", RelativeReminder.account))
+                    if f"{table}_datetime" in indexes:
+                        migrate(migrator.drop_index(table, f"{table}_datetime"))
+            self.database.create_tables([RelativeReminder])
+            if LegacyRelativeReminder.table_exists():
+                with self.database.atomic():
+                    for reminder in LegacyRelativeReminder.select():
+                        status = json.loads(reminder.status)
+                        RelativeReminder.create(
+                            status_id=str(status["id"]),
+                            acct=status["account"]["acct"],
+                            visibility=status["visibility"],
+                            datetime=reminder.datetime,
+                        )
+                    self.database.drop_tables([LegacyRelativeReminder])
+
+    def add(
+        self,
+        status_id: str,
+        acct: str,
+        visibility: str,
+        due: datetime.datetime,
+        account: str = DEFAULT_ACCOUNT,
+    ) -> int:
+        """Store a reminder for the bot account named account to post, and return its id."""
+        with STORAGE_SECONDS.labels("add").time(), self.database.connection_context():
+            return RelativeReminder.create(
+                status_id=status_id,
+                acct=acct,
+                visibility=visibility,
+                datetime=due,
+                account=account,
+            ).id
+
+    def upcoming(
+        self, until: datetime.datetime, accounts: Collection[str] = (DEFAULT_ACCOUNT,)
+    ) -> list[tuple[int, datetime.datetime]]:
+        """Return the (id, due) of every reminder due at or before until."""
+        with STORAGE_SECONDS.labels("upcoming").time(), self.database.connection_context():
+            return list(
+                RelativeReminder.select(RelativeReminder.id, RelativeReminder.datetime)
+                .where(
+                    (RelativeReminder.datetime <= until)
+                    & RelativeReminder.account.in_(list(accounts))
+                )
+                .tuples()
+            )
+
+    def claim(
+        self, reminder_ids: list[int], accounts: Collection[str] = (DEFAULT_ACCOUNT,)
+    ) -> list[tuple[str, str, str, str]]:
+        """
+        Delete reminders by id, returning the (status_id, acct, visibility, account) of the ones that were deleted.
+        Only rows this call deleted are returned (with RETURNING), so reminders that were already claimed
+        (for example, by another process) are skipped instead of being sent twice.
+        """
+        claimed = []
+        with STORAGE_SECONDS.labels("claim").time(), self.database.connection_context():
+            for start in range(0, len(reminder_ids), self.batch_size):
+                batch = reminder_ids[start : start + self.batch_size]
+                claimed.extend(
+                    RelativeReminder.delete()
+                    .where(RelativeReminder.id.in_(self._claimable(batch, accounts)))
+                    .returning(
+                        RelativeReminder.status_id,
+                        RelativeReminder.acct,
+                        RelativeReminder.visibility,
+                        RelativeReminder.account,
+                    )
+                    .tuples()
+                    .execute()
+                )
+        return claimed
+
+    def _claimable(self, reminder_ids: list[int], accounts: Collection[str]) -> peewee.Select:
+        """Return a query for the ids of the reminders in reminder_ids that belong to accounts."""
+        return RelativeReminder.select(RelativeReminder.id).where(
+            RelativeReminder.id.in_(reminder_ids) & RelativeReminder.account.in_(list(accounts))
+        )
+
+    def close(self):
+        """Close every pooled connection."""
+        self.database.close_all()
+
+
+class PostgresReminderStorage(ReminderStorage):
+    """
+    Reminders stored in Postgres, which can be shared by several processes.
+    Connections idle for longer than stale_timeout are recycled, and threads wait up to 10 seconds for a free connection.
+    """
+
+    def __init__(
+        self,
+        database: str,
+        user: str,
+        password: str,
+        host: str,
+        port: int,
+        max_connections: int = 8,
+        stale_timeout: int = 300,
+    ):
+        super().__init__(
+            PooledPostgresqlDatabase(
+                database,
+                user=user,
+                password=password,
+                host=host,
+                port=port,
+                max_connections=max_connections,
+                stale_timeout=stale_timeout,
+                timeout=10,
+            )
+        )
+
+    def _claimable(self, reminder_ids: list[int], accounts: Collection[str]) -> peewee.Select:
+        # Rows another process is claiming are skipped instead of waited for
+        return super()._claimable(reminder_ids, accounts).for_update("FOR UPDATE SKIP LOCKED")
+
+
+class SqliteReminderStorage(ReminderStorage):
+    """
+    Reminders stored in an embedded SQLite database, for single-process deployments that don't want to run Postgres.
+    WAL mode lets reads happen alongside the single writer, and synchronous=FULL fsyncs every commit so reminders survive a crash.
+    Adding a reminder costs a local fsync instead of a network round trip.
+    """
+
+    def __init__(self, path: str, max_connections: int = 8):
+        super().__init__(
+            PooledSqliteDatabase(
+                path,
+                pragmas={
+                    "journal_mode": "wal",
+                    "synchronous": "full",
+                    # Wait for the write lock instead of failing right away
+                    "busy_timeout": 5000,
+                },
+                max_connections=max_connections,
+                timeout=10,
+                # A pooled connection is only used by one thread at a time, but not always the thread that opened it
+                check_same_thread=False,
+            )
+        )
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import datetime
+import functools
+import re
+
+from pystodon.lib.processes import ProcessPool
+
+# Most reminders are in one of a few forms, which are parsed with these regexes instead of dateparser:
+# "in 5 minutes", "in 1h30m", "in an hour and 20 minutes", "tomorrow at 9:30", "today at 5pm", or an ISO 8601 timestamp
+# Anything else is passed to dateparser, which is much slower (it detects the language and tries many formats)
+UNIT_SECONDS = {
+    "s": 1,
+    "m": 60,
+    "h": 60 * 60,
+    "d": 24 * 60 * 60,
+    "w": 7 * 24 * 60 * 60,
+}
+# The units are ordered so longer spellings are tried first, and (?![a-z]) stops "m" from matching the start of "months"
+UNIT = r"(seconds?|secs?|s|minutes?|mins?|m|hours?|hrs?|h|days?|d|weeks?|wks?|w)(?![a-z])"
+AMOUNT = r"(?:(\d+)\s*|(an?|one)\s+)"
+PART_REGEX = re.compile(AMOUNT + UNIT, flags=re.IGNORECASE)
+RELATIVE_REGEX = re.compile(
+    rf"^(?:in\s+)?{AMOUNT}{UNIT}(?:(?:\s*,\s*|\s+and\s+|\s*){AMOUNT}{UNIT})*(?:\s+from\s+now)?$",
+    flags=re.IGNORECASE,
+)
+DAY_REGEX = re.compile(
+    r"^(today|tomorrow)(?:\s+(?:at\s+)?(\d{1,2})(?::(\d{2}))?\s*(am|pm)?)?$",
+    flags=re.IGNORECASE,
+)
+ISO_REGEX = re.compile(r"^\d{4}-\d{2}-\d{2}(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?(?:Z|[+-]\d{2}:?\d{2})?$")
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_recipe(text: str) -> tuple | None:
+    """
+    Turn an expression in one of the fast path forms into a recipe that doesn't depend on the current time, or return None.
+    Recipes are ("relative", timedelta), ("day", days from today, hour, minute), or ("absolute", datetime).
+    Cached since the same expressions come up over and over.
+    """
+    if RELATIVE_REGEX.match(text):
+        seconds = 0
+        for number, word, unit in PART_REGEX.findall(text):
+            amount = int(number) if number else 1
+            seconds += amount * UNIT_SECONDS[unit[0].lower()]
+        try:
+            return ("relative", datetime.timedelta(seconds=seconds))
+        except OverflowError:
+            # More than timedelta can hold (about 2.7 million years)
+            return None
+    if matches := DAY_REGEX.match(text):
+        day, hour, minute, meridiem = matches.groups()
+        days = 1 if day.lower() == "tomorrow" else 0
+        if hour is None:
+            # "tomorrow" on its own means this time tomorrow
+            return ("relative", datetime.timedelta(days=days)) if days else None
+        hour = int(hour)
+        minute = int(minute) if minute else 0
+        if meridiem:
+            if not (1 <= hour <= 12):
+                return None
+            hour = hour % 12 + (12 if meridiem.lower() == "pm" else 0)
+        if not (0 <= hour <= 23 and 0 <= minute <= 59):
+            return None
+        return ("day", days, hour, minute)
+    if ISO_REGEX.match(text):
+        try:
+            return ("absolute", to_local(datetime.datetime.fromisoformat(text)))
+        except (ValueError, OverflowError):
+            return None
+    return None
+
+
+def to_local(dt: datetime.datetime) -> datetime.datetime:
+    """Return a naive datetime in local time, converting it first if it's timezone-aware."""
+    if dt.tzinfo is not None:
+        return dt.astimezone().replace(tzinfo=None)
+    return dt
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_with_dateparser(text: str, base: datetime.datetime) -> datetime.datetime | None:
+    """
+    Parse an expression with dateparser, relative to base.
+    Cached per (expression, base to the second), so a burst of the same expression only gets parsed once,
+    and expressions dateparser can't understand aren't retried over and over within the same second.
+    The parsing itself runs in the process pool if it's running, since it's CPU-bound.
+    """
+    return ProcessPool.run(dateparser_parse, text, base)
+
+
+def dateparser_parse(text: str, base: datetime.datetime) -> datetime.datetime | None:
+    """The uncached part of parse_with_dateparser(), which can be sent to another process."""
+    # dateparser is slow to import, so it's only imported if it's needed
+    import dateparser
+
+    dt = dateparser.parse(text, settings={"RELATIVE_BASE": base})
+    return to_local(dt) if dt is not None else None
+
+
+def parse_time(text: str | None, now: datetime.datetime = None) -> datetime.datetime | None:
+    """
+    Return the (naive, local) datetime an expression such as "in 5 minutes" refers to, or None if it can't be parsed.
+    Common forms are parsed with a compiled grammar, and everything else falls back to dateparser.
+    """
+    if not text:
+        return None
+    text = " ".join(text.split())
+    if now is None:
+        now = datetime.datetime.now()
+    if (recipe := parse_recipe(text)) is not None:
+        kind = recipe[0]
+        if kind == "relative":
+            try:
+                return now + recipe[1]
+            except OverflowError:
+                # Past the year 9999
+                return None
+        if kind == "day":
+            _, days, hour, minute = recipe
+            return (now + datetime.timedelta(days=days)).replace(
+                hour=hour, minute=minute, second=0, microsecond=0
+            )
+        return recipe[1]
+    return parse_with_dateparser(text, now.replace(microsecond=0))
@@ -0,0 +1,144 @@
+from __future__ import annotations
+import json
+import os
+import threading
+from collections import Counter
+from pathlib import Path
+
+from loguru import logger
+
+# An index from the ways people name a place to its IANA timezone, used by #timezone.
+# It's built from pytz (zone names, and the city each is named after) and airportsdata (IATA and ICAO codes, and airport cities),
+# which takes a few hundred milliseconds, so the built index is cached on disk and loaded from there next time.
+# Keys are normalized (see normalize()), so lookups are a single dict lookup.
+
+# Bumped whenever what's in the index changes, so old cache files aren't used
+INDEX_FORMAT = 1
+
+
+def normalize(query: str) -> str:
+    """Return a query in the form index keys are stored in: casefolded, with underscores as spaces and runs of whitespace collapsed."""
+    return " ".join(query.replace("_", " ").split()).casefold()
+
+
+def cache_directory() -> Path:
+    return Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "pystodon"
+
+
+class TimezoneIndex:
+    """
+    Resolves IANA timezone names (case-insensitively), IATA and ICAO airport codes, and city names to timezones.
+    When a key could mean more than one thing, IANA names win over the cities they're named after,
+    which win over airport codes, which win over the cities airports are in.
+    Zones are stored once in a list and keys map to their position in it, which keeps the index (and its cache file) compact.
+    """
+
+    def __init__(self, zones: list[str], keys: dict[str, int]):
+        self.zones = zones
+        self.keys = keys
+        # tzinfo objects by zone name, created the first time each zone is looked up
+        self._tzinfos = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def versions() -> str:
+        """The versions of the data the index is built from, which the cache file is named after."""
+        from importlib.metadata import version
+
+        return f"{INDEX_FORMAT}-pytz{version('pytz')}-airportsdata{version('airportsdata')}"
+
+    @classmethod
+    def build(cls) -> TimezoneIndex:
+        """Build the index from pytz and airportsdata."""
+        import airportsdata
+        import pytz
+
+        zones = []
+        positions = {}
+        keys = {}
+
+        def add(key: str, zone: str):
+            # Keys that are already taken belong to something that was added earlier, which takes priority
+            key = normalize(key)
+            if not key or key in keys or zone not in pytz.all_timezones_set:
+                return
+            if (position := positions.get(zone)) is None:
+                position = positions[zone] = len(zones)
+                zones.append(zone)
+            keys[key] = position
+
+        # Common zones go first, so a city like "Indianapolis" resolves to the canonical America/Indiana/Indianapolis
+        names = [*pytz.common_timezones, *pytz.all_timezones]
+        for name in names:
+            add(name, name)
+        for name in names:
+            if "/" in name:
+                add(name.rsplit("/", 1)[1], name)
+        airports = airportsdata.load("ICAO")
+        for airport in airports.values():
+            if airport["iata"]:
+                add(airport["iata"], airport["tz"])
+        for airport in airports.values():
+            add(airport["icao"], airport["tz"])
+        # A city's airports can be in different zones (or there can be several cities with the same name), so the most common one is used
+        cities = {}
+        for airport in airports.values():
+            if airport["city"]:
+                cities.setdefault(normalize(airport["city"]), Counter())[airport["tz"]] += 1
+        for city, counts in cities.items():
+            add(city, counts.most_common(1)[0][0])
+        return cls(zones, keys)
+
+    @classmethod
+    def load(cls, directory: Path = None) -> TimezoneIndex:
+        """Load the index from the cache, building (and caching) it if it isn't cached yet."""
+        directory = directory if directory is not None else cache_directory()
+        path = directory / f"timezones-{cls.versions()}.json"
+        try:
+            data = json.loads(path.read_text())
+            return cls(data["zones"], data["keys"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError):
+            logger.warning(f"Couldn't read the timezone index at {path}; rebuilding it")
+        index = cls.build()
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_name(path.name + ".tmp")
+            temporary.write_text(json.dumps({"zones": index.zones, "keys": index.keys}, separators=(",", ":")))
+            os.replace(temporary, path)
+        except OSError:
+            # A read-only filesystem just means it's built again next time
+            logger.warning(f"Couldn't cache the timezone index at {path}")
+        return index
+
+    def lookup(self, query: str) -> str | None:
+        """Return the IANA name of the timezone a query refers to, or None."""
+        if (position := self.keys.get(normalize(query))) is None:
+            return None
+        return self.zones[position]
+
+    def tzinfo(self, query: str):
+        """Return the tzinfo for the timezone a query refers to, or None."""
+        if (zone := self.lookup(query)) is None:
+            return None
+        if (tzinfo := self._tzinfos.get(zone)) is None:
+            import pytz
+
+            tzinfo = self._tzinfos[zone] = pytz.timezone(zone)
+        return tzinfo
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> TimezoneIndex:
+    """Return the shared index, loading it the first time it's needed."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = TimezoneIndex.load()
+        return _index
@@ -1,15 +1,77 @@
-from bs4 import BeautifulSoup
-import re
-from mastodon import Mastodon, StreamListener
+import functools
+import time
+from contextlib import nullcontext
+
+from loguru import logger
+from mastodon import Mastodon, MastodonNotFoundError, StreamListener
+from pystodon.lib.accounts import CURRENT_ACCOUNT, DEFAULT_ACCOUNT
+from pystodon.lib.clients import MastodonClients
 from pystodon.lib.command import Command, CheckThis
+from pystodon.lib.journal import PostJournal
+from pystodon.lib.metrics import (
+    MENTIONS,
+    OUTBOX_DEPTH,
+    POSTS_TO_DELETE,
+    QUEUE_DEPTH,
+    QUEUE_REJECTED,
+    REPLY_SECONDS,
+)
+from pystodon.lib.outbound import PRIORITY_BULK, Outbox
+from pystodon.lib.notifications import NotificationTracker, notification_id_key
+from pystodon.lib.status import ParsedStatus, html_to_text
+from pystodon.lib.workers import NotificationQueue
 import trio
 
+BUSY_MESSAGE = "I'm busy right now. Please try again in a bit."
+TIMEOUT_MESSAGE = "That took too long, so I gave up. Please try again in a bit."
+# Mastodon's default character limit, used if the instance doesn't report one
+DEFAULT_MAX_CHARACTERS = 500
+
+
+class InstanceCache:
+    """
+    Instance metadata that's fetched once and refreshed in the background every ttl seconds, so replies don't have to fetch it.
+    """
+
+    def __init__(self, mastodon: Mastodon, ttl: int = 3600):
+        self.mastodon = mastodon
+        self.ttl = ttl
+        self._max_characters = None
+
+    @property
+    def max_characters(self) -> int:
+        """Get the maximum number of characters in a status, fetching the instance metadata if it hasn't been fetched yet"""
+        if self._max_characters is None:
+            self.refresh()
+        return self._max_characters
+
+    def refresh(self):
+        """Fetch the instance metadata."""
+        instance = self.mastodon.instance()
+        try:
+            self._max_characters = instance["configuration"]["statuses"]["max_characters"]
+        except (KeyError, TypeError):
+            self._max_characters = DEFAULT_MAX_CHARACTERS
+
+    async def refresh_forever(self):
+        """Refresh the instance metadata every ttl seconds. If a refresh fails, the old metadata is kept."""
+        while True:
+            await trio.sleep(self.ttl)
+            try:
+                await trio.to_thread.run_sync(self.refresh)
+            except Exception:
+                logger.exception("Failed to refresh instance metadata")
+
 
 class stream_listener:
     """
     A class of functions to allow for easy streaming of Mastodon statuses with sensible defaults.
+    Each one serves an account; several can be served from one process with stream_all().
     """
 
+    # Every account's listener, by name, so reminders can be posted as the account they were set with
+    accounts = {}
+
     def __init__(
         self,
         mastodon_access_token: str,
@@ -17,36 +79,124 @@ class stream_listener:
         delete_when_done: bool = False,
         always_mention: bool = True,
         commands: list = None,
+        workers: int = 4,
+        queue_size: int = 100,
+        queue_full_policy: str = "block",
+        instance_cache_ttl: int = 3600,
+        mastodon: Mastodon = None,
+        state_path: str = None,
+        backfill_page_size: int = 40,
+        delete_journal_path: str = None,
+        delete_concurrency: int = 8,
+        delete_batch_size: int = 500,
+        name: str = DEFAULT_ACCOUNT,
     ):
         """
         Initialize the class.
+        name is the name of the account, which its metrics are labelled with and its reminders are stored under.
+        Mentions are queued (up to queue_size) and handled by a pool of worker tasks, with queue_full_policy deciding what happens when the queue is full.
+        Instance metadata (such as the character limit) is cached and refreshed every instance_cache_ttl seconds.
+        If a client isn't passed, the account's shared client from MastodonClients is used.
+        Whenever the stream (re)connects, mentions missed while it was down are fetched backfill_page_size at a time.
+        The last notification handled is saved to state_path (if it's set) so mentions missed while the bot wasn't running are fetched too.
+        If delete_when_done is set, the ids of posts are kept in a journal at delete_journal_path (or in memory if it isn't set),
+        and deleted delete_concurrency at a time when the bot stops, queueing delete_batch_size at a time.
         """
         # self.mastodon_access_token = mastodon_access_token
         # self.mastodon_api_base_url = mastodon_api_base_url
+        self.name = name
         self.delete_when_done = delete_when_done
         self.always_mention = always_mention
         self.commands = commands
+        if not ((workers > 0) and isinstance(workers, int)):
+            raise ValueError("Workers must be a positive integer")
+        self.workers = workers
+        self.queue = NotificationQueue(maxsize=queue_size, policy=queue_full_policy)
+        # Mentions handed off by workers to wait for a busy command in their own task
+        self._waiting_for_command = 0
+        # Set once the Trio loop is running so the streaming thread can hand notifications to it
+        self.trio_token = None
+        self.tracker = NotificationTracker(state_path)
+        self.backfill_page_size = backfill_page_size
+        if not ((delete_concurrency > 0) and isinstance(delete_concurrency, int)):
+            raise ValueError("Delete concurrency must be a positive integer")
+        self.delete_concurrency = delete_concurrency
+        self.delete_batch_size = delete_batch_size
+        # Posts are only tracked if they're going to be deleted
+        self.posts_to_delete = PostJournal(delete_journal_path) if delete_when_done else None
+        # The cursor to fetch missed mentions after, set when the stream connects
+        self._backfill_since = None
+        self._backfill_requested = None
 
-        self.mastodon = Mastodon(
-            access_token=mastodon_access_token, api_base_url=mastodon_api_base_url
+        self.mastodon = (
+            mastodon
+            if mastodon is not None
+            else MastodonClients.get(
+                access_token=mastodon_access_token,
+                api_base_url=mastodon_api_base_url,
+                # Each worker may be posting at the same time
+                pool_maxsize=max(10, workers),
+            )
+        )
+        self.instance_cache = InstanceCache(self.mastodon, ttl=instance_cache_ttl)
+        # Replies and deletions go through the account's Outbox so they're rate limited and retried
+        self.outbox = MastodonClients.outbox(self.mastodon)
+        self.fully_configured_stream_listener = self.partially_configured_stream_listener(
+            mastodon=self.mastodon,
+            delete_when_done=self.delete_when_done,
+            always_mention=self.always_mention,
+            commands=self.commands,
+            submit=self.submit,
+            instance_cache=self.instance_cache,
+            outbox=self.outbox,
+            on_connect=self.connected,
+            posts_to_delete=self.posts_to_delete,
+            account=self.name,
         )
+        QUEUE_DEPTH.labels(self.name).set_function(lambda: len(self.queue))
+        OUTBOX_DEPTH.labels(self.name).set_function(lambda: len(self.outbox))
+        POSTS_TO_DELETE.labels(self.name).set_function(lambda: len(self.posts_to_delete or ()))
+        stream_listener.accounts[self.name] = self
 
     class partially_configured_stream_listener(StreamListener):
         """
         What events cause what actions.
+        If submit is set, mentions are passed to it instead of being handled on the streaming thread.
+        posts_to_delete is the PostJournal of posts to delete when the bot stops, or None if they aren't being deleted.
         """
 
-        posts_to_delete = []
         def __init__(
             self,
             mastodon: Mastodon,
             delete_when_done: bool = False,
             always_mention: bool = True,
             commands: list = None,
+            submit: callable = None,
+            instance_cache: InstanceCache = None,
+            outbox: Outbox = None,
+            on_connect: callable = None,
+            posts_to_delete: PostJournal = None,
+            account: str = DEFAULT_ACCOUNT,
         ):
             self.mastodon = mastodon
             self.always_mention = always_mention
             self.commands = commands
+            self.submit = submit
+            self.on_connect = on_connect
+            self.posts_to_delete = posts_to_delete
+            self.account = account
+            self.instance_cache = (
+                instance_cache if instance_cache is not None else InstanceCache(mastodon)
+            )
+            self.outbox = outbox if outbox is not None else MastodonClients.outbox(mastodon)
+
+        def handle_stream(self, response):
+            # Mastodon.py calls this with each new connection, including reconnections, before reading any events
+            # This runs on the account's streaming thread, so mentions handled on it are handled as the account
+            CURRENT_ACCOUNT.set(self.account)
+            if self.on_connect is not None:
+                self.on_connect()
+            return super().handle_stream(response)
 
         def on_update(self, status):
             # As far as I can tell, an update caused when you reblog or when an account you follow posts something  # noqa E501
@@ -57,96 +207,384 @@ class stream_listener:
 
         def on_notification(self, notification):
             if notification["type"] == "mention":
-                content = Command.parse_status(
-                    status=notification["status"],
-                    always_mention=self.always_mention,
-                    commands=self.commands,
-                )  # noqa E501
-                if content is None:
-                    return
-                if (
-                    len(content)
-                    > self.mastodon.instance().configuration.statuses.max_characters
-                ):
-                    print(
-                        f"ERROR: The content returned by the command was too long ({self.mastodon.instance().configuration.statuses.max_characters} characters). Please try again."
-                    )
-                    return
-                post = self.mastodon.status_post(
-                    # Set the content of the status to the string returned above
-                    content,
-                    # Reply to the mention
-                    in_reply_to_id=notification["status"]["id"],
-                    # Match the visibility of the mention
-                    visibility=notification["status"]["visibility"],
-                )
-                self.posts_to_delete.append(post["id"])
-
+                if self.submit is None:
+                    self.respond(ParsedStatus(notification["status"]), time.monotonic())
+                else:
+                    self.submit(notification)
             elif notification["type"] == "favourite":
                 pass
             else:
                 pass
 
+        def respond(self, status: ParsedStatus, received: float = None):
+            """
+            Run the command in a status and reply with the result.
+            received is when (in time.monotonic()) the mention arrived, which is used to measure how long the reply took.
+            """
+            label = Command.metric_label(status.command, self.commands)
+            content = Command.parse_status(
+                status=status,
+                always_mention=self.always_mention,
+                commands=self.commands,
+            )  # noqa E501
+            self.deliver(status, content, received, label)
+
+        async def respond_async(self, status: ParsedStatus, received: float = None):
+            """
+            The same as respond(), but called from the Trio loop, so async commands are awaited in it.
+            If the command times out, the mention is answered with TIMEOUT_MESSAGE.
+            """
+            label = Command.metric_label(status.command, self.commands)
+            try:
+                content = await Command.parse_status_async(
+                    status=status,
+                    always_mention=self.always_mention,
+                    commands=self.commands,
+                )
+            except trio.TooSlowError:
+                MENTIONS.labels(label, "timeout").inc()
+                logger.warning(f"{label} timed out for status {status['id']}")
+                content = TIMEOUT_MESSAGE
+                if self.always_mention:
+                    content = f"@{status['account']['acct']}\n{content}"
+                self.reply(status, content, received, label)
+                return
+            self.deliver(status, content, received, label)
+
+        def deliver(self, status: ParsedStatus, content: str | None, received: float = None, label: str = "none"):
+            """Reply with what a command returned, unless it returned nothing or it's too long to post."""
+            if content is None:
+                MENTIONS.labels(label, "no_reply").inc()
+                return
+            max_characters = self.instance_cache.max_characters
+            if len(content) > max_characters:
+                MENTIONS.labels(label, "too_long").inc()
+                logger.error(
+                    f"The content returned by the command was too long ({len(content)} > {max_characters} characters)"
+                )
+                return
+            MENTIONS.labels(label, "replied").inc()
+            self.reply(status, content, received, label)
+
+        def reply(self, status: dict, content: str, received: float = None, label: str = "none"):
+            """Queue a reply to a status, matching its visibility."""
+
+            def posted(post):
+                if self.posts_to_delete is not None:
+                    self.posts_to_delete.append(post["id"])
+                if received is not None:
+                    REPLY_SECONDS.labels(label).observe(time.monotonic() - received)
+
+            self.outbox.submit(
+                "status_post",
+                # Set the content of the status to the string returned above
+                content,
+                # Reply to the mention
+                in_reply_to_id=status["id"],
+                # Match the visibility of the mention
+                visibility=status["visibility"],
+                callback=posted,
+            )
+
     def stream(self):
         """
         Stream statuses.
         """
-        self.fully_configured_stream_listener = (
-            self.partially_configured_stream_listener(
-                mastodon=self.mastodon,
-                delete_when_done=self.delete_when_done,
-                always_mention=self.always_mention,
-                commands=self.commands,
-            )
-        )
-        self.mastodon.stream_user(self.fully_configured_stream_listener, run_async=True)
         trio.run(self.sleep_or_not)
 
+    def posted(self, post: dict):
+        """Track a post made as this account outside of a reply (such as a reminder) to be deleted when the bot stops, if posts are being deleted."""
+        if self.posts_to_delete is not None:
+            self.posts_to_delete.append(post["id"])
+
+    def submit(self, notification):
+        """
+        Queue a mention to be handled by a worker. Called from the streaming thread.
+        What happens when the queue is full depends on the queue's policy.
+        Mentions are queued along with when they arrived.
+        Mentions that have already been handled (such as ones replayed after a reconnect) are skipped.
+        """
+        if not self.tracker.claim(notification["id"]):
+            logger.debug(f"Skipping notification {notification['id']}, which was already handled")
+            return
+        item = (time.monotonic(), notification)
+        if self.queue.policy == "block":
+            trio.from_thread.run(self.queue.put, item, trio_token=self.trio_token)
+            return
+        rejected = trio.from_thread.run_sync(
+            self.queue.put_nowait, item, trio_token=self.trio_token
+        )
+        if rejected is None:
+            return
+        QUEUE_REJECTED.labels(self.queue.policy).inc()
+        received, rejected = rejected
+        # Dropped or answered with the busy message, so it won't be handled
+        self.tracker.done(rejected["id"])
+        if self.queue.policy == "drop-oldest":
+            logger.warning(f"Notification queue is full; dropped notification {rejected['id']}")
+        else:
+            status = rejected["status"]
+            content = BUSY_MESSAGE
+            if self.always_mention:
+                content = f"@{status['account']['acct']}\n{content}"
+            self.fully_configured_stream_listener.reply(status, content, received, "busy")
+
+    async def worker(self, nursery: trio.Nursery):
+        """
+        Handle queued mentions one at a time, forever.
+        A mention for a command that's already running as many times as it's allowed to waits for it in its own task (started in nursery),
+        so it doesn't hold up the mentions behind it. Once queue_size mentions are waiting like that, the worker waits too.
+        """
+        # Each worker is its own task, so this only applies to the commands it runs (and the threads they run in),
+        # including the tasks it hands mentions off to
+        CURRENT_ACCOUNT.set(self.name)
+        while True:
+            received, notification = await self.queue.get()
+            try:
+                # Content that needs BeautifulSoup is parsed off the loop, so the other workers and the Outbox keep going
+                status = await ParsedStatus.parse_async(notification["status"])
+                command = (
+                    Command.get_command(status.command, self.commands)
+                    if status.command is not None
+                    else None
+                )
+            except Exception:
+                MENTIONS.labels("none", "error").inc()
+                logger.exception(f"Failed to handle notification {notification['id']}")
+                self.tracker.done(notification["id"])
+                continue
+            limiter = command.limiter if command is not None else None
+            if (
+                limiter is not None
+                and limiter.available_tokens == 0
+                and self._waiting_for_command < self.queue.maxsize
+            ):
+                self._waiting_for_command += 1
+                nursery.start_soon(self._respond_when_free, status, received, notification, limiter)
+            else:
+                await self.respond(status, received, notification, limiter)
+
+    async def respond(
+        self, status: ParsedStatus, received: float, notification: dict, limiter: trio.CapacityLimiter = None
+    ):
+        """Respond to a queued mention and mark it as done."""
+        label = "none"
+        try:
+            label = Command.metric_label(status.command, self.commands)
+            # Hold the command's limiter (if it has one) so it doesn't run more times at once than allowed
+            async with limiter if limiter is not None else nullcontext():
+                # Async commands are awaited here, and synchronous ones are run in a thread to keep the loop free
+                await self.fully_configured_stream_listener.respond_async(status, received)
+        except Exception:
+            MENTIONS.labels(label, "error").inc()
+            logger.exception(f"Failed to handle notification {notification['id']}")
+        finally:
+            self.tracker.done(notification["id"])
+
+    async def _respond_when_free(
+        self, status: ParsedStatus, received: float, notification: dict, limiter: trio.CapacityLimiter
+    ):
+        """Respond to a mention handed off by a worker, once its command's limiter is free."""
+        try:
+            await self.respond(status, received, notification, limiter)
+        finally:
+            self._waiting_for_command -= 1
+
+    def connected(self):
+        """
+        Ask for missed mentions to be fetched. Called on the streaming thread whenever the stream (re)connects.
+        The cursor is read here, before the new connection delivers anything, so mentions that arrive
+        on the new connection don't move it past the ones that were missed.
+        """
+        since_id = self.tracker.cursor
+        try:
+            trio.from_thread.run_sync(
+                self._request_backfill, since_id, trio_token=self.trio_token
+            )
+        except trio.RunFinishedError:
+            pass
+
+    def _request_backfill(self, since_id: str | None):
+        """Queue a backfill after since_id. If one is already queued, the earlier cursor is used."""
+        cursors = [c for c in (self._backfill_since, since_id) if c is not None]
+        self._backfill_since = min(cursors, key=notification_id_key) if cursors else None
+        self._backfill_requested.set()
+
+    async def backfill_forever(self):
+        """Fetch missed mentions whenever the stream (re)connects."""
+        while True:
+            await self._backfill_requested.wait()
+            self._backfill_requested = trio.Event()
+            since_id, self._backfill_since = self._backfill_since, None
+            try:
+                await self.backfill(since_id)
+            except Exception:
+                logger.exception("Failed to fetch mentions missed while the stream was down")
+
+    async def backfill(self, since_id: str | None):
+        """
+        Queue mentions that arrived after since_id, oldest first, along with any left unfinished when the bot last stopped.
+        Notifications are fetched a page at a time, and each page waits for space in the queue,
+        so a long outage is worked through at the workers' pace instead of all at once.
+        If since_id is None (the bot has never handled a mention), old mentions aren't fetched.
+        """
+        fetched = 0
+        # Mentions that were queued but not handled when the bot last stopped
+        for notification_id in list(self.tracker.recovered):
+            try:
+                notification = await trio.to_thread.run_sync(
+                    self.mastodon.notifications, notification_id
+                )
+            except MastodonNotFoundError:
+                notification = None
+            self.tracker.recovered.remove(notification_id)
+            if notification is not None and self.tracker.claim(notification["id"]):
+                await self.queue.put((time.monotonic(), notification))
+                fetched += 1
+
+        min_id = since_id
+        while min_id is not None:
+            page = await trio.to_thread.run_sync(
+                functools.partial(
+                    self.mastodon.notifications,
+                    min_id=min_id,
+                    types=["mention"],
+                    limit=self.backfill_page_size,
+                )
+            )
+            if not page:
+                break
+            # Pages are newest first
+            page = sorted(page, key=lambda n: notification_id_key(n["id"]))
+            for notification in page:
+                if notification["type"] == "mention" and self.tracker.claim(notification["id"]):
+                    await self.queue.put((time.monotonic(), notification))
+                    fetched += 1
+            min_id = page[-1]["id"] if len(page) >= self.backfill_page_size else None
+        if fetched:
+            logger.info(f"Fetched {fetched} mentions missed while the stream was down")
+
+    async def save_state_forever(self, interval: float = 5):
+        """Save the notification cursor every interval seconds (if it's changed)."""
+        while True:
+            await trio.sleep(interval)
+            try:
+                await trio.to_thread.run_sync(self.tracker.save)
+            except OSError:
+                logger.exception("Failed to save the notification cursor")
+
     async def sleep_or_not(self):
         """Used to optionally run other code while the stream is running, in addition to optionally deleting posts when done"""
+        await serve_all([self])
+
+    async def serve(self, nursery: trio.Nursery):
+        """Start the account's workers and background tasks in nursery, then start its stream."""
+        self.trio_token = trio.lowlevel.current_trio_token()
+        self._backfill_requested = trio.Event()
+        # Load the instance metadata up front so the first reply doesn't have to
+        await trio.to_thread.run_sync(self.instance_cache.refresh)
+        nursery.start_soon(self.instance_cache.refresh_forever)
+        nursery.start_soon(self.outbox.run)
+        nursery.start_soon(self.backfill_forever)
+        nursery.start_soon(self.save_state_forever)
+        for _ in range(self.workers):
+            nursery.start_soon(self.worker, nursery)
+        # The stream is started once the workers can accept notifications
+        # The stream reconnects by itself if it's dropped, and missed mentions are fetched when it does
+        await trio.to_thread.run_sync(
+            lambda: self.mastodon.stream_user(
+                self.fully_configured_stream_listener,
+                run_async=True,
+                reconnect_async=True,
+            )
+        )
+        logger.info(f"Streaming as {self.name}")
+
+    async def shutdown(self):
+        """Finish up when the bot stops: send what's still queued, save the cursor, and delete posts if they're being deleted."""
+        # Send any replies that were still queued first, so the posts they make are deleted too
+        await self.outbox.drain()
+        self.tracker.save()
+        if self.delete_when_done:
+            await self.delete_posts()
+
+    async def delete_posts(self):
+        """
+        Delete the posts in the journal, up to delete_concurrency at once (still paced by the Outbox's rate limiting).
+        Each deletion is journaled as it succeeds, so if this is interrupted, the rest are deleted the next time it runs.
+        """
+        journal = self.posts_to_delete
+        pending = journal.pending()
+        if not pending:
+            return
+        logger.info(f"Deleting {len(pending)} of {self.name}'s posts")
+
+        def not_found(post_id, exception):
+            # Already deleted, so there's nothing left to do
+            # Other failures leave the post in the journal to try again next time
+            if isinstance(exception, MastodonNotFoundError):
+                journal.remove(post_id)
+
         try:
-            # async with trio.open_nursery() as nursery:
-            #     # If I remember correctly, the reason sleep_forever is used is so the program doesn't exist killing the stream listener
-            #     nursery.start_soon(trio.sleep_forever)
-            #     async def loop_run_checks():
-            #         while True:
-            #             await CheckThis.run_checks()
-            #     nursery.start_soon(loop_run_checks)
-            while True:
-                CheckThis.run_checks()
+            # Queued a batch at a time so a long run's worth of deletions isn't all held in the Outbox at once
+            for start in range(0, len(pending), self.delete_batch_size):
+                for post_id in pending[start : start + self.delete_batch_size]:
+                    self.outbox.submit(
+                        "status_delete",
+                        post_id,
+                        priority=PRIORITY_BULK,
+                        callback=lambda _, post_id=post_id: journal.remove(post_id),
+                        errback=functools.partial(not_found, post_id),
+                    )
+                await self.outbox.drain(concurrency=self.delete_concurrency)
+        except BaseException:
+            # Interrupted again (or cancelled since another account's deletion was); what's been deleted is already journaled
+            logger.warning(f"Stopped deleting {self.name}'s posts; {len(journal)} are left for next time")
+            journal.close()
+            raise
+        journal.compact()
+        if remaining := len(journal):
+            logger.warning(f"{remaining} posts couldn't be deleted; they'll be tried again next time")
+
+
+async def serve_all(listeners: list[stream_listener]):
+    """
+    Serve several accounts at once, each with its own stream, workers, and Outbox, sharing one scheduler.
+    When the bot is stopped, every account is shut down at once. Stopping it again stops deleting posts.
+    """
+    try:
+        async with trio.open_nursery() as nursery:
+            # Accounts are started at once, so a slow instance doesn't hold up the rest
+            async with trio.open_nursery() as starting:
+                for listener in listeners:
+                    starting.start_soon(listener.serve, nursery)
+            # run_forever() never returns, which also keeps the program from exiting and killing the stream listeners
+            nursery.start_soon(CheckThis.run_forever)
+    except KeyboardInterrupt:
+        try:
+            async with trio.open_nursery() as stopping:
+                for listener in listeners:
+                    stopping.start_soon(listener.shutdown)
         except KeyboardInterrupt:
-            if self.delete_when_done:
-                for post in self.fully_configured_stream_listener.posts_to_delete:
-                    self.mastodon.status_delete(post)
+            # Whatever wasn't deleted is left in each account's journal for next time
+            pass
+
+
+def stream_all(listeners: list[stream_listener]):
+    """Stream as every account in listeners from this process."""
+    trio.run(serve_all, listeners)
 
 
-def return_raw_argument(status: dict):
+def return_raw_argument(status: dict | ParsedStatus):
     """
     Return the raw arguments (everything after the command) as a string.
     Uses utils.parse_html() to parse the HTML, adding newlines after every <p> tag
+    If the status is a ParsedStatus, the argument has already been parsed and is returned as-is
     In many cases, if regex is being used anyway, it's better to use that instead
     """
-    content = parse_html(html_content=status["content"])
-    # Match f
-    # re.DOTALL is present so commands can span multiple lines
-    if matches := re.search(
-        r"^(?:(?:@\S+@?\S+)\s+)?(?:\S+)(?:\s?(.*))$",
-        # From what I can tell, there w1ill always be a mention, even if it's a reply. Some clients just don't show it in the body content. Either way, making it optional shouldn't have any negative effects.
-        content,
-        flags=re.IGNORECASE | re.DOTALL,
-    ):
-        return matches.group(1).rstrip()
-    else:
-        # Unsure if it should return None or an empty string
-        return None
+    return ParsedStatus.from_status(status).argument
 
 
 def parse_html(html_content: str):
     """Return the raw post content, with newlines after every <p> tag"""
-
-    content = BeautifulSoup(html_content, "html.parser")
-    for p in content.find_all("p"):
-        p.insert_after("\n")
-        # Perhaps don't insert a newline if it's the last <p> tag?
-    raw_content = content.get_text(separator="")
-    return raw_content
+    return html_to_text(html_content)
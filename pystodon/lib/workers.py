@@ -0,0 +1,82 @@
+from __future__ import annotations
+from collections import deque
+
+import trio
+
+# What to do when a notification arrives and the queue is full
+# "block" makes the streaming thread wait for space, "drop-oldest" drops the oldest queued notification,
+# and "busy" rejects the new notification so the caller can reply that the bot is busy
+QUEUE_FULL_POLICIES = ("block", "drop-oldest", "busy")
+
+
+class NotificationQueue:
+    """
+    A bounded FIFO queue of notifications, consumed by worker tasks in the Trio loop.
+    Must only be used from the Trio thread (other threads should use trio.from_thread).
+    """
+
+    def __init__(self, maxsize: int = 100, policy: str = "block"):
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._not_empty = trio.lowlevel.ParkingLot()
+        self._not_full = trio.lowlevel.ParkingLot()
+
+    # Setters/Getters
+    @property
+    def maxsize(self):
+        """Get the maximum number of queued notifications"""
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, maxsize: int):
+        """Set the maximum number of queued notifications if it is a positive integer"""
+        if not ((maxsize > 0) and isinstance(maxsize, int)):
+            raise ValueError("Queue size must be a positive integer")
+        self._maxsize = maxsize
+
+    @property
+    def policy(self):
+        """Get the policy used when the queue is full"""
+        return self._policy
+
+    @policy.setter
+    def policy(self, policy: str):
+        """Set the policy used when the queue is full if it is one of QUEUE_FULL_POLICIES"""
+        if policy not in QUEUE_FULL_POLICIES:
+            raise ValueError(f"Policy must be one of {', '.join(QUEUE_FULL_POLICIES)}")
+        self._policy = policy
+
+    def __len__(self):
+        return len(self._items)
+
+    async def put(self, item):
+        """Add an item, waiting for space if the queue is full."""
+        while len(self._items) >= self.maxsize:
+            await self._not_full.park()
+        self._items.append(item)
+        self._not_empty.unpark()
+
+    def put_nowait(self, item):
+        """
+        Add an item without waiting.
+        If the queue is full, return the item that didn't make it in: the oldest item for "drop-oldest", or the new item otherwise.
+        Return None if nothing was rejected.
+        """
+        if len(self._items) < self.maxsize:
+            self._items.append(item)
+            self._not_empty.unpark()
+            return None
+        if self.policy == "drop-oldest":
+            dropped = self._items.popleft()
+            self._items.append(item)
+            return dropped
+        return item
+
+    async def get(self):
+        """Remove and return the oldest item, waiting for one if the queue is empty."""
+        while not self._items:
+            await self._not_empty.park()
+        item = self._items.popleft()
+        self._not_full.unpark()
+        return item
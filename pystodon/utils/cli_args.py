@@ -3,18 +3,17 @@ import os
 import sys
 from pathlib import Path
 
-# Can't do from pystodon.utils import logger since that would cause a circular import
 from pystodon.utils.logging import logger
+from pystodon.lib.workers import QUEUE_FULL_POLICIES
 
 import dotenv
 
 
-def set_argparse() -> None:
+def set_argparse(argv: list[str] = None) -> argparse.Namespace:
     """
-    Set up the argument parser and parse the arguments to args
+    Set up the argument parser, parse the arguments, and return them
+    This is called once, by main(), so importing pystodon doesn't parse arguments
     """
-    global args
-
     if Path(".env").is_file():
         dotenv.load_dotenv()
         logger.info("Loaded .env file")
@@ -31,6 +30,11 @@ def set_argparse() -> None:
         default=os.getenv("RC_MASTODON_API_BASE_URL"),
         help="The base URL for the Mastodon API.",
     )
+    argparser.add_argument(
+        "--accounts-file",
+        default=os.getenv("RC_ACCOUNTS_FILE"),
+        help="A TOML file of accounts to serve from this process, instead of the single account set by --mastodon-access-token and --mastodon-api-base-url. See the README for the format.",
+    )
     argparser.add_argument(
         "--weather-api-key",
         default=os.getenv("RC_WEATHER_API_KEY"),
@@ -45,6 +49,17 @@ def set_argparse() -> None:
             help="Delete posts when gracefully exiting the program.",
         ),
     )
+    argparser.add_argument(
+        "--delete-journal-path",
+        default=os.getenv("RC_DELETE_JOURNAL_PATH", "pystodon-posts.journal"),
+        help="Where to keep the ids of posts to delete, if --delete-posts-after-run is set. Posts that weren't deleted (such as if the bot crashed) are deleted the next time it stops.",
+    )
+    argparser.add_argument(
+        "--delete-concurrency",
+        type=int,
+        default=int(os.getenv("RC_DELETE_CONCURRENCY", "8")),
+        help="How many posts to delete at once when stopping. Deletions are still paced by --post-rate and the instance's rate limit.",
+    )
     (
         argparser.add_argument(
             "--always-mention",
@@ -54,7 +69,68 @@ def set_argparse() -> None:
         ),
     )
 
+    workers = argparser.add_argument_group("Worker options")
+    workers.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("RC_WORKERS", "4")),
+        help="The number of mentions to handle at once.",
+    )
+    workers.add_argument(
+        "--queue-size",
+        type=int,
+        default=int(os.getenv("RC_QUEUE_SIZE", "100")),
+        help="The maximum number of mentions waiting to be handled.",
+    )
+    workers.add_argument(
+        "--queue-full-policy",
+        choices=QUEUE_FULL_POLICIES,
+        default=os.getenv("RC_QUEUE_FULL_POLICY", "block"),
+        help="What to do with a new mention when the queue is full: wait for space, drop the oldest queued mention, or reply that the bot is busy.",
+    )
+    workers.add_argument(
+        "--post-rate",
+        type=float,
+        default=float(os.getenv("RC_POST_RATE", "1")),
+        help="The sustained number of statuses posted (or deleted) per second, on top of the instance's rate limit.",
+    )
+    workers.add_argument(
+        "--post-burst",
+        type=int,
+        default=int(os.getenv("RC_POST_BURST", "30")),
+        help="The number of statuses that can be posted at once before --post-rate applies.",
+    )
+    workers.add_argument(
+        "--processes",
+        type=int,
+        default=int(os.getenv("RC_PROCESSES", "0")),
+        help="The number of processes for CPU-bound work (HTML parsing that needs BeautifulSoup, dateparser, and commands added with cpu_bound=True). 0 runs it in the bot's process.",
+    )
+
+    argparser.add_argument(
+        "--state-path",
+        default=os.getenv("RC_STATE_PATH", "pystodon-state.json"),
+        help="Where to save the last notification handled, so mentions missed while the bot was down are answered when it restarts.",
+    )
+    argparser.add_argument(
+        "--instance-cache-ttl",
+        type=int,
+        default=int(os.getenv("RC_INSTANCE_CACHE_TTL", "3600")),
+        help="How often (in seconds) to refresh the cached instance metadata, such as the character limit.",
+    )
+
     db = argparser.add_argument_group("Database options")
+    db.add_argument(
+        "--reminder-storage",
+        choices=("postgres", "sqlite"),
+        default=os.getenv("RC_REMINDER_STORAGE"),
+        help="Where to store reminders. Defaults to Postgres if the Postgres options are set.",
+    )
+    db.add_argument(
+        "--sqlite-path",
+        default=os.getenv("RC_SQLITE_PATH", "pystodon.db"),
+        help="The path to the SQLite database, if reminders are stored in SQLite.",
+    )
     db.add_argument(
         "--postgres-db",
         default=os.getenv("POSTGRES_DB"),
@@ -80,6 +156,56 @@ def set_argparse() -> None:
         default=os.getenv("POSTGRES_PORT"),
         help="The port for the Postgres database.",
     )
+    db.add_argument(
+        "--postgres-max-connections",
+        type=int,
+        default=int(os.getenv("POSTGRES_MAX_CONNECTIONS", "8")),
+        help="The maximum number of pooled connections to the Postgres database.",
+    )
+    db.add_argument(
+        "--postgres-stale-timeout",
+        type=int,
+        default=int(os.getenv("POSTGRES_STALE_TIMEOUT", "300")),
+        help="How long (in seconds) a pooled connection can be idle before it's recycled.",
+    )
+
+    metrics = argparser.add_argument_group("Metrics options")
+    metrics.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("RC_METRICS_PORT")) if os.getenv("RC_METRICS_PORT") else None,
+        help="Serve Prometheus metrics (such as per-command latency) on this port. Off if unset.",
+    )
+    metrics.add_argument(
+        "--metrics-host",
+        default=os.getenv("RC_METRICS_HOST", "127.0.0.1"),
+        help="The address to serve metrics on.",
+    )
+
+    profiling = argparser.add_argument_group("Profiling options")
+    profiling.add_argument(
+        "--profile",
+        action="store_true",
+        default=os.getenv("RC_PROFILE", "False").lower() == "true",
+        help="Sample command handlers, HTML parsing, and scheduled checks, and periodically write the stacks in the collapsed format flame graph tools read.",
+    )
+    profiling.add_argument(
+        "--profile-dir",
+        default=os.getenv("RC_PROFILE_DIR", "profiles"),
+        help="The directory to write profiles to.",
+    )
+    profiling.add_argument(
+        "--profile-interval",
+        type=float,
+        default=float(os.getenv("RC_PROFILE_INTERVAL", "60")),
+        help="How often (in seconds) to write a profile.",
+    )
+    profiling.add_argument(
+        "--profile-sample-interval",
+        type=float,
+        default=float(os.getenv("RC_PROFILE_SAMPLE_INTERVAL", "0.01")),
+        help="How often (in seconds) to sample. Longer intervals have less overhead.",
+    )
 
     debug = argparser.add_argument_group("Debugging options")
     debug.add_argument(
@@ -87,21 +213,20 @@ def set_argparse() -> None:
         default="DEBUG",
         help="The log level to use.",
     )
-    check_required_args(["mastodon_access_token", "mastodon_api_base_url"], argparser)
-    args = argparser.parse_args()
+    args = argparser.parse_args(argv)
+    # An accounts file has the credentials for each account instead
+    if args.accounts_file is None:
+        check_required_args(["mastodon_access_token", "mastodon_api_base_url"], args)
+    return args
 
 
-def check_required_args(required_args: list[str], argparser: argparse.ArgumentParser):
+def check_required_args(required_args: list[str], args: argparse.Namespace):
     """
     Check if required arguments are set
     Useful if using enviroment variables with argparse as default and required are mutually exclusive
     """
     for arg in required_args:
-        args = argparser.parse_args()
         if getattr(args, arg) is None:
             # raise ValueError(f"{arg} is required")
             logger.critical(f"{arg} is required")
             sys.exit(1)
-
-
-set_argparse()